@@ -0,0 +1,260 @@
+""" bench_fix.py - Benchmark of FixMusicFile on synthetic libraries
+    Generates reproducible libraries from the tests/sample.mp3 and tests/sample.m4a
+    templates, with varied nesting, tag completeness and a mix of MP3 and M4A files,
+    then measures each stage (scan, tag read, merge, save, move, clean) and whole runs,
+    in dry-run and real modes.
+
+    For each measure: seconds, files/sec, peak RSS so far and the number of audited
+    system calls (open, listdir/scandir, mkdir, rename, rmdir, remove... as reported
+    by sys.addaudithook; stat calls are not audited by Python).
+
+    PYTHONPATH=src python benchmarks/bench_fix.py --sizes 1000 10000 --out out.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4
+from mutagen.id3 import TPE1, TALB
+from sortmp3.fix import FixMusicFile, clean_parents
+from sortmp3.formats import open_tags, read_tags
+from sortmp3.scan import scan_music_files
+
+log = logging.getLogger("bench_fix")
+
+SAMPLES = Path(__file__).resolve().parent.parent / "tests"
+
+#
+# audited system calls, counted while measuring
+#
+AUDITED = {"open", "os.listdir", "os.scandir", "os.mkdir", "os.rename", "os.replace",
+           "os.rmdir", "os.remove", "os.truncate", "shutil.copyfile", "shutil.move",
+           "mmap.__new__"}
+calls = Counter()
+counting = False
+
+
+def audit(event, args):
+    if counting and event in AUDITED:
+        calls[event] += 1
+
+
+class Library:
+    """
+        Reproducible synthetic library of n files below root.
+        Tag completeness: no tags, artist only, or artist and album.
+        Nesting: flat, album folder, artist/album folders, or a deeper inbox.
+    """
+
+    COMPLETENESS = ("none", "artist", "full")
+
+    def __init__(self, n, seed=0, m4a_ratio=0.3):
+        self.n = n
+        self.seed = seed
+        self.m4a_ratio = m4a_ratio
+        self.artists = max(10, n // 100)
+        self.templates = {}
+
+    def template(self, filtyp, completeness, artist, album):
+        """ bytes of a sample file of type filtyp with the given tags, built once """
+        key = (filtyp, completeness,
+               artist if completeness != "none" else None,
+               album if completeness == "full" else None)
+        try:
+            return self.templates[key]
+        except KeyError:
+            pass
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, "sample." + filtyp)
+            shutil.copy(SAMPLES / path.name, path)
+            if completeness != "none":
+                if filtyp == "mp3":
+                    audio = MP3(path)
+                    audio["TPE1"] = TPE1(encoding=3, text=artist)
+                    if completeness == "full":
+                        audio["TALB"] = TALB(encoding=3, text=album)
+                else:
+                    audio = MP4(path)
+                    audio["\xa9ART"] = [artist]
+                    if completeness == "full":
+                        audio["\xa9alb"] = [album]
+                audio.save()
+            data = self.templates[key] = path.read_bytes()
+        return data
+
+    def generate(self, root):
+        """ writes the library below root """
+        rnd = random.Random(self.seed)
+        root = Path(root)
+        for k in range(self.n):
+            a = rnd.randrange(self.artists)
+            artist = f"Artist {a}"
+            album = f"Album {a}-{rnd.randrange(5)}"
+            title = f"Title {k}"
+            filtyp = "m4a" if rnd.random() < self.m4a_ratio else "mp3"
+            completeness = rnd.choice(self.COMPLETENESS)
+            nesting = rnd.randrange(4)
+            if nesting == 0:
+                folder = root
+            elif nesting == 1:
+                folder = root / album
+            elif nesting == 2:
+                folder = root / artist / album
+            else:
+                folder = root / "inbox" / str(k % 10) / album
+            folder.mkdir(parents=True, exist_ok=True)
+            name = f"{artist} - {title}"
+            if rnd.random() < 0.2:
+                # to be title cased
+                name = name.lower()
+            data = self.template(filtyp, completeness, artist, album)
+            (folder / f"{name}.{filtyp}").write_bytes(data)
+            if rnd.random() < 0.05:
+                # not music, left alone
+                (folder / f"notes {k}.txt").write_text("notes")
+
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def measure(results, files, mode, stage, fn):
+    """ runs fn, records its measures in results and returns its result """
+    global counting
+    calls.clear()
+    counting = True
+    start = time.perf_counter()
+    try:
+        out = fn()
+    finally:
+        seconds = time.perf_counter() - start
+        counting = False
+    results.append({
+        "files": files,
+        "mode": mode,
+        "stage": stage,
+        "seconds": round(seconds, 6),
+        "files_per_sec": round(files / seconds, 1) if seconds else None,
+        "peak_rss_kb": peak_rss_kb(),
+        "syscalls": dict(sorted(calls.items())),
+    })
+    log.info(f"{files:>7} {mode:<4} {stage:<6} {seconds:9.3f}s "
+             f"{files / seconds:12,.0f} files/s")
+    return out
+
+
+def read_stage(candidates):
+    """ the tags of the candidates, from their headers or with mutagen """
+    tags = []
+    for file, match in candidates:
+        t = read_tags(file, match.group(3).lower())
+        if t is None:
+            audio = open_tags(file, match.group(3).lower())
+            t = {it: audio.get(it, [""])[0] for it in FixMusicFile.ITEMS}
+        tags.append(t)
+    return tags
+
+
+def save_stage(decisions):
+    """ saves the new tags of the decisions that change them """
+    for d in decisions:
+        if d.retag:
+            audio = open_tags(d.source, d.source.suffix[1:].lower())
+            for it in FixMusicFile.ITEMS:
+                audio[it] = d.tags_after[it]
+            audio.save()
+
+
+def move_stage(fixer, decisions):
+    """ moves the files of the decisions, returns the folders they left """
+    touched = set()
+    for d in decisions:
+        if d.target.exists():
+            continue
+        fixer.dirs.ensure(d.target_dir)
+        fixer.mover.move(d.source, d.target)
+        touched.add(d.source.parent)
+    return touched
+
+
+def stages(results, library, work, dry_run):
+    """ measures each stage of a run, one after the other, on a fresh library """
+    mode = "dry" if dry_run else "real"
+    inf, outf = work / "in", work / "out"
+    library.generate(inf)
+    outf.mkdir()
+    fixer = FixMusicFile(infolder=inf, outfolder=outf, dry_run=True)
+    n = library.n
+    candidates = measure(results, n, mode, "scan", lambda: list(scan_music_files(inf)))
+    tags = measure(results, n, mode, "read", lambda: read_stage(candidates))
+
+    def merge():
+        return [fixer.decide(file, match.groups(), cached)
+                for (file, match), cached in zip(candidates, tags)]
+    decisions = measure(results, n, mode, "merge", merge)
+    if dry_run:
+        return
+    measure(results, n, mode, "save", lambda: save_stage(decisions))
+    touched = measure(results, n, mode, "move", lambda: move_stage(fixer, decisions))
+    measure(results, n, mode, "clean", lambda: clean_parents(touched, inf))
+
+
+def end_to_end(results, library, work, dry_run):
+    """ measures a whole run on a fresh library """
+    inf, outf = work / "in", work / "out"
+    library.generate(inf)
+    outf.mkdir()
+    fixer = FixMusicFile(infolder=inf, outfolder=outf, dry_run=dry_run)
+    measure(results, library.n, "dry" if dry_run else "real", "run", fixer.run)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark FixMusicFile on synthetic libraries")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir",
+                        help="where libraries are generated, a temporary folder "
+                             "by default")
+    parser.add_argument("--out", default="bench_fix.json",
+                        help="JSON file of the results")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # per file messages of the runs are not part of the measures
+    logging.getLogger().setLevel(logging.WARNING)
+    log.setLevel(logging.INFO)
+    sys.addaudithook(audit)
+    results = []
+    for size in args.sizes:
+        library = Library(size, args.seed)
+        for dry_run in (True, False):
+            for bench_fn in (stages, end_to_end):
+                with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+                    bench_fn(results, library, Path(tmp), dry_run)
+    report = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    log.info(f"Results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+""" bench_names.py - Micro-benchmark of name normalization
+    Compares the memoized translation tables of sortmp3.names with the regex version
+    they replaced, on a library where a few thousand artist and album names repeat
+    across many files.
+
+    PYTHONPATH=src python benchmarks/bench_names.py [files] [distinct names]
+"""
+
+import random
+import re
+import sys
+import timeit
+from sortmp3 import names
+
+
+def re_normalize_spaces(text):
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def re_sanitize(s):
+    return re_normalize_spaces(re.sub(r'[<>:"/\\|?*\x00-\x1F]', ' ', s)[:255])
+
+
+def library(files, distinct):
+    """ files names drawn from distinct artist or album names """
+    rnd = random.Random(0)
+    pool = [f"Artist {i}:  Live / Part {i % 7}?\t" for i in range(distinct)]
+    return [rnd.choice(pool) for _ in range(files)]
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 3_000
+    data = library(files, distinct)
+    assert [re_sanitize(s) for s in data] == names.normalize_many(data)
+    cases = {
+        "regex": lambda: [re_sanitize(s) for s in data],
+        "tables": lambda: [names.sanitize.__wrapped__(s) for s in data],
+        "memoized": lambda: [names.sanitize(s) for s in data],
+        "normalize_many": lambda: names.normalize_many(data),
+    }
+    base = None
+    for label, fn in cases.items():
+        t = min(timeit.repeat(fn, number=1, repeat=3))
+        base = base or t
+        print(f"{label:>15}: {files / t:12,.0f} names/s  x{base / t:.1f}")
+
+
+if __name__ == "__main__":
+    main()
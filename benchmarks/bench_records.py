@@ -0,0 +1,63 @@
+""" bench_records.py - Memory of per-file records
+    Measures with tracemalloc the memory held per file by a Catalog of compact records,
+    against a list of the Decisions they stand for, on synthetic libraries.
+
+    PYTHONPATH=src python benchmarks/bench_records.py [files]
+"""
+
+import sys
+import tracemalloc
+from pathlib import Path
+from sortmp3.fix import Decision
+from sortmp3.records import Catalog
+
+ROOT = "/intake"
+
+
+def entries(n):
+    """ n synthetic files: 2% of artists and albums are distinct, titles are unique """
+    artists = max(1, n // 50)
+    for i in range(n):
+        a = i % artists
+        artist = f"Artist {a}"
+        album = f"Album {a}-{i % 5}"
+        title = f"Title {i}"
+        yield f"{ROOT}/inbox/{album}/{artist} - {title}.mp3", artist, album, title
+
+
+def catalog(n):
+    c = Catalog(ROOT)
+    for source, artist, album, title in entries(n):
+        c.append(source, {"artist": artist, "album": album, "title": title}, True)
+    return c
+
+
+def decisions(n):
+    music = Path("/music/Music")
+    out = []
+    for source, artist, album, title in entries(n):
+        tags = {"artist": artist, "album": album, "title": title}
+        target_dir = music / artist / album
+        target = target_dir / f"{artist} - {title}.mp3"
+        out.append(Decision(Path(source), target_dir, target, dict(tags), tags, True))
+    return out
+
+
+def measure(fn, n):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = fn(n)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{'records':>10}: {measure(catalog, n):8.1f} bytes per file")
+    print(f"{'decisions':>10}: {measure(decisions, n):8.1f} bytes per file")
+
+
+if __name__ == "__main__":
+    main()
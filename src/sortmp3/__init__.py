@@ -0,0 +1,18 @@
+""" sortmp3 - Sort and store MP3 and M4A music files in a Music Hierarchy
+
+    Embedding API:
+
+        from sortmp3 import FixMusicFile
+        for result in FixMusicFile(infolder, outfolder, dry_run=False).process(paths):
+            ...
+"""
+
+__all__ = ["FixMusicFile", "Decision", "Result"]
+
+
+def __getattr__(name):
+    # loaded on first use, so that importing a submodule does not load them all
+    if name in __all__:
+        from sortmp3 import fix
+        return getattr(fix, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,182 @@
+""" Module aio.py - Asyncio pipeline
+    Runs FixMusicFile as scan, tag read, decide, tag write and move stages
+    linked by bounded queues, for use inside an asyncio application:
+
+        n = await AsyncFixer(FixMusicFile(infolder, outfolder, dry_run=False)).run()
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from sortmp3.fix import FixMusicFile
+from sortmp3.scan import scan_music_files
+from sortmp3.formats import read_tags
+
+# end of stream, one per worker of the next stage
+DONE = None
+
+# candidates listed by the scanner per call
+SCAN_BATCH = 64
+
+
+def read_file_tags(fixer, file, filtyp):
+    """ {artist, album, title} of file: from its header, or with mutagen when not
+        possible """
+    cached = read_tags(file, filtyp)
+    if cached is None:
+        audiofile = fixer.load(file, filtyp)
+        cached = {it: audiofile.get(it, [""])[0] for it in FixMusicFile.ITEMS}
+    return cached
+
+
+class AsyncFixer:
+    """
+        Fixes the music files of fixer's infolder with concurrent stages.
+        Stages are linked by queues of at most queue_size items, so that a fast scan
+        waits for slow writes or moves instead of piling up files in memory.
+        Blocking calls run on a thread pool per stage, limiting its concurrency:
+        read_jobs tag reads, decide_jobs merges (and fingerprints), write_jobs tag
+        saves. Folder creation, duplicate checks and the caches are handled on a single
+        thread, files being placed as they come; moves run on fixer's move streams,
+        at most queue_size of them in flight.
+        A file that cannot be fixed is logged and skipped.
+    """
+
+    def __init__(self, fixer, queue_size=64, read_jobs=4, decide_jobs=2, write_jobs=2):
+        self.fixer = fixer
+        self.queue_size = max(1, int(queue_size))
+        self.read_jobs = max(1, int(read_jobs))
+        self.decide_jobs = max(1, int(decide_jobs))
+        self.write_jobs = max(1, int(write_jobs))
+        self.failed = 0
+        self.pools = {}
+
+    async def call(self, pool, fn, *args):
+        """ runs fn(*args) on the thread pool of a stage """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pools[pool], fn, *args)
+
+    async def run(self):
+        """ fixes the music files found in the infolder, returns their number """
+        fixer = self.fixer
+        jobs = {
+            # begin, placement and finish: the caches stay on the thread they were
+            # opened on
+            "place": 1,
+            "scan": 1,
+            "read": self.read_jobs,
+            "decide": self.decide_jobs,
+            "write": self.write_jobs,
+        }
+        self.pools = {stage: ThreadPoolExecutor(max_workers=workers,
+                                                thread_name_prefix=f"sortmp3-{stage}")
+                      for stage, workers in jobs.items()}
+        candidates, read, decided, written = (asyncio.Queue(self.queue_size)
+                                              for i in range(4))
+        logging.info("Starting exploring music files in %s", fixer.infolder)
+        # files already put in the Music Hierarchy are skipped when infolder and
+        # outfolder are the same
+        placed = set()
+        n = p = 0
+        try:
+            await self.call("place", fixer.begin)
+            tasks = [
+                asyncio.ensure_future(self.scan(candidates, placed, self.read_jobs)),
+                asyncio.ensure_future(self.stage(self.read, candidates, read,
+                                                 self.read_jobs, self.decide_jobs)),
+                asyncio.ensure_future(self.stage(self.decide, read, decided,
+                                                 self.decide_jobs, self.write_jobs)),
+                asyncio.ensure_future(self.stage(self.write, decided, written,
+                                                 self.write_jobs, 1)),
+                asyncio.ensure_future(self.place(written, placed)),
+            ]
+            try:
+                n = (await asyncio.gather(*tasks))[-1]
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            await self.call("place", partial(fixer.settle_moves, wait=True))
+            p = await self.call("place", fixer.clean_touched)
+        finally:
+            await self.call("place", fixer.finish)
+            for pool in self.pools.values():
+                pool.shutdown(wait=True)
+        logging.info("Files processed: %d", n)
+        if self.failed:
+            logging.warning("Files skipped on error: %d", self.failed)
+        if p:
+            logging.info("Folders cleaned: %d", p)
+        return n
+
+    async def scan(self, out, placed, consumers):
+        """ puts (file, groups) of the music files of the shard found in the infolder
+            to out """
+        it = scan_music_files(self.fixer.infolder, skip=placed, walk=self.fixer.walk)
+        while batch := await self.call("scan", lambda: list(islice(it, SCAN_BATCH))):
+            for file, match in batch:
+                if self.fixer.mine(file):
+                    await out.put((file, match.groups()))
+        for i in range(consumers):
+            await out.put(DONE)
+
+    async def stage(self, fn, inq, out, workers, consumers):
+        """ workers tasks put fn(item) to out for each item of inq, until DONE """
+        async def worker():
+            while (item := await inq.get()) is not DONE:
+                try:
+                    result = await fn(item)
+                except Exception as e:
+                    self.failed += 1
+                    logging.error("Cannot fix %s. Reason: %s", item[0], e)
+                    continue
+                await out.put(result)
+        await asyncio.gather(*(worker() for i in range(workers)))
+        for i in range(consumers):
+            await out.put(DONE)
+
+    async def read(self, item):
+        """ candidate completed with its tags and cached fingerprint """
+        file, groups = item
+        cached = digest = None
+        if self.fixer.index is not None or self.fixer.fingerprints is not None:
+            file, groups, cached, digest = await self.call("place", self.fixer.known,
+                                                           file, groups)
+        if cached is None:
+            cached = await self.call("read", read_file_tags, self.fixer, file,
+                                     groups[2].lower())
+        return file, groups, cached, digest
+
+    async def decide(self, item):
+        return await self.call("decide", partial(self.fixer.decide, *item, write=False))
+
+    async def write(self, decision):
+        # journaled tags are saved once the decision is journaled, when placed
+        if not self.fixer.use_journal:
+            await self.call("write", self.fixer.retag, decision)
+        return decision
+
+    def place_one(self, decision):
+        """ places decision, then waits for the oldest moves while more than
+            queue_size are in flight """
+        final = self.fixer.place(decision)
+        self.fixer.settle_moves(limit=self.queue_size)
+        return final
+
+    async def place(self, inq, placed):
+        """ places the decisions of inq, returns their number """
+        n = 0
+        while (decision := await inq.get()) is not DONE:
+            try:
+                final = await self.call("place", self.place_one, decision)
+            except Exception as e:
+                self.failed += 1
+                logging.error("Cannot fix %s. Reason: %s", decision.source, e)
+                continue
+            n += 1
+            if final != decision.source:
+                placed.add(str(final))
+        return n
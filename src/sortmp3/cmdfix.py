@@ -1,8 +1,9 @@
-""" Script cmdfix.py - CLI interface for FixMusicFile """
+""" Script cmdfix.py - CLI interface for FixMusicFile
+    FixMusicFile and the logging setup are imported once the args are valid,
+    so that --help and usage errors are quick.
+"""
 import argparse
-from sortmp3.fullog import Full_Log
 import logging
-from sortmp3.fix import FixMusicFile
 
 DEBUG = True
 
@@ -32,8 +33,44 @@ class CmdFix:
             else:
                 return arg
 
+    def is_valid_shard(self, arg):
+        """ i/N: shard i of N, i from 1 to N """
+        try:
+            i, n = (int(x) for x in arg.split("/"))
+        except ValueError:
+            self.parser.error("Shard should be i/N")
+        if not 1 <= i <= n:
+            self.parser.error("Shard should be i/N with i from 1 to N")
+        return i, n
+
+    def is_valid_date(self, arg):
+        """ ISO date or date and time, local time unless an offset is given
+            returns a timestamp """
+        from datetime import datetime
+        try:
+            return datetime.fromisoformat(arg).timestamp()
+        except ValueError:
+            self.parser.error("Date should be YYYY-MM-DD or YYYY-MM-DDTHH:MM")
+
+    def is_valid_size(self, arg):
+        """ a number of bytes, optionally followed by K, M or G (powers of 1024) """
+        units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+        arg = arg.strip().upper()
+        scale = units.get(arg[-1:], 1)
+        try:
+            size = int(float(arg[:-1] if arg[-1:] in units else arg) * scale)
+        except ValueError:
+            self.parser.error("Size should be a number of bytes, e.g. 500K or 2M")
+        if size < 0:
+            self.parser.error("Size should not be negative")
+        return size
+
     def setup_parser(self):
         """ add args to parser p"""
+        self.parser.add_argument(
+            'mode', nargs='?', choices=['fix', 'watch'], default='fix',
+            help='fix the infolder once, or watch it and fix files as they land. '
+                 'Default is fix.')
         self.parser.add_argument('-i', '--infolder', dest='infolder',
                                  help='Input folder.  Default is current folder.',
                                  default=".")
@@ -50,13 +87,108 @@ class CmdFix:
         self.parser.add_argument('--title', help='Specify File or Tag',
                                  type=lambda x: self.is_valid_priority(x),
                                  default="Tag")
-        self.parser.add_argument('--dry_run', help='Show file moves but leave music files unchanged',
-                                 action='store_true', default=False)
+        self.parser.add_argument(
+            '--dry_run', action='store_true', default=False,
+            help='Show file moves but leave music files unchanged')
         self.parser.add_argument('--overwrite', help='Duplicates overwrite existing files',
                                  action='store_true', default=False)
+        self.parser.add_argument(
+            '-j', '--jobs', type=int, default=1,
+            help='Number of worker threads for tag reading and writing. Default is 1.')
+        self.parser.add_argument(
+            '--executor', choices=["thread", "process"], default="thread",
+            help='Run workers as threads (I/O bound) or processes (CPU bound). '
+                 'Default is thread.')
+        self.parser.add_argument(
+            '--index', action='store_true', default=False,
+            help='Keep an index of processed files in OUTFOLDER/.sortmp3 '
+                 'to skip unchanged files next time')
+        self.parser.add_argument(
+            '--streams', type=int, default=1,
+            help='Number of concurrent file moves. Default is 1.')
+        self.parser.add_argument(
+            '--verify', action='store_true', default=False,
+            help='Check copies across filesystems against their source '
+                 'before removing it')
+        self.parser.add_argument(
+            '--dest-index', action='store_true', default=False,
+            help='List the Music Hierarchy once at startup '
+                 'to find duplicates in memory')
+        self.parser.add_argument(
+            '--dest-snapshot', default=None,
+            help='Load the list of the Music Hierarchy from DEST_SNAPSHOT, '
+                 'and save it there after the run')
+        self.parser.add_argument(
+            '--dedupe', action='store_true', default=False,
+            help='Find duplicates by audio content, whatever their tags')
+        plan = self.parser.add_mutually_exclusive_group()
+        plan.add_argument(
+            '--plan', default=None,
+            help='Write the plan of file moves to PLAN (one JSON object per line) '
+                 'and leave music files unchanged')
+        plan.add_argument(
+            '--apply', default=None,
+            help='Execute the plan saved in APPLY without scanning the infolder again')
+        plan.add_argument(
+            '--resume', action='store_true', default=False,
+            help='Continue the run recorded in the journal, '
+                 'without parsing the files it processed again')
+        plan.add_argument(
+            '--undo', action='store_true', default=False,
+            help='Undo the run recorded in the journal: '
+                 'move files back and restore their tags')
+        self.parser.add_argument(
+            '--shard', type=lambda x: self.is_valid_shard(x), metavar='I/N',
+            default=None,
+            help='Process only shard I of N of the infolder, '
+                 'split by a hash of file paths, e.g. 1/3')
+        self.parser.add_argument(
+            '--include', action='append', default=[], metavar='PATTERN',
+            help='Only process files matching the glob PATTERN, against their name or, '
+                 'with a slash, their path in the infolder. May be repeated.')
+        self.parser.add_argument(
+            '--exclude', action='append', default=[], metavar='PATTERN',
+            help='Skip files and folders matching the glob PATTERN, '
+                 'against their name or, with a slash, their path in the infolder. '
+                 'May be repeated.')
+        self.parser.add_argument(
+            '--newer-than', type=lambda x: self.is_valid_date(x), metavar='DATE',
+            default=None,
+            help='Only process files modified after DATE, e.g. 2024-01-31')
+        self.parser.add_argument(
+            '--min-size', type=lambda x: self.is_valid_size(x), metavar='SIZE',
+            default=None,
+            help='Only process files of at least SIZE bytes, e.g. 500K')
+        self.parser.add_argument(
+            '--journal', action='store_true', default=False,
+            help='Journal file moves and tag changes in OUTFOLDER/.sortmp3 '
+                 'so that the run can be resumed or undone')
+        self.parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Watch mode: seconds between checks for new files. Default is 1.')
+        self.parser.add_argument(
+            '--settle', type=float, default=2.0,
+            help='Watch mode: seconds a file size must stay unchanged '
+                 'before it is fixed. Default is 2.')
+        self.parser.add_argument(
+            '--poll', action='store_true', default=False,
+            help='Watch mode: poll the infolder instead of using inotify')
+        self.parser.add_argument(
+            '--profile', action='store_true', default=False,
+            help='Time each stage of the run and log a breakdown at the end')
+        self.parser.add_argument(
+            '--cprofile', default=None,
+            help='Save cProfile stats of the run to CPROFILE')
+        self.parser.add_argument(
+            '--tracemalloc', default=None,
+            help='Save a tracemalloc snapshot taken at the end of the run '
+                 'to TRACEMALLOC')
         self.parser.add_argument("--log-level", default="INFO",
                                  choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
                                 help="Log level, default is  'INFO'")
+        self.parser.add_argument('--log-queue',
+                                 help='Write log messages from a background thread',
+                                 action='store_true', default=False)
 
         self.parser.description = """ Fix Music File looks for music files in the infolder and transfers them
          to the outfolder. Each file is located in the Music Hierarchy. Music / Artist / Album / Title according
@@ -65,28 +197,84 @@ class CmdFix:
 
     def parse(self, args=None):
         pa = self.parser.parse_args(args)
+        self.mode = pa.mode
         self.infolder = pa.infolder
         self.outfolder = pa.outfolder
         self.artist = pa.artist
         self.title = pa.title
         self.album = pa.album
         self.log_level = pa.log_level
+        self.log_queue = pa.log_queue
         self.dry_run = pa.dry_run
         self.overwrite = pa.overwrite
+        self.jobs = pa.jobs
+        self.executor = pa.executor
+        self.index = pa.index
+        self.streams = pa.streams
+        self.verify = pa.verify
+        self.dest_index = pa.dest_index
+        self.dest_snapshot = pa.dest_snapshot
+        self.dedupe = pa.dedupe
+        self.plan = pa.plan
+        self.apply = pa.apply
+        self.resume = pa.resume
+        self.undo = pa.undo
+        self.journal = pa.journal
+        self.shard = pa.shard
+        self.include = pa.include
+        self.exclude = pa.exclude
+        self.newer_than = pa.newer_than
+        self.min_size = pa.min_size
+        self.interval = pa.interval
+        self.settle = pa.settle
+        self.poll = pa.poll or None
+        self.profile = pa.profile
+        self.cprofile = pa.cprofile
+        self.tracemalloc = pa.tracemalloc
         if DEBUG:
             #
             # check parsed args
             #
-            for k in dir(pa):
-                if not k.startswith('_'):
-                    logging.debug(f"  {k}: {eval('pa.' + k)}")
+            for k, v in vars(pa).items():
+                logging.debug("  %s: %s", k, v)
 
     def run(self):
+        from sortmp3.fix import FixMusicFile
+        from sortmp3.profiling import Profiler
         try:
+            profiler = None
+            if self.profile or self.cprofile or self.tracemalloc:
+                profiler = Profiler(cprofile=self.cprofile,
+                                    tracemalloc=self.tracemalloc)
             fixer = FixMusicFile(self.infolder, self.outfolder, artist=self.artist,
-                                 title=self.title, album=self.album, dry_run=self.dry_run)
+                                 title=self.title, album=self.album,
+                                 dry_run=self.dry_run, overwrite=self.overwrite,
+                                 jobs=self.jobs, executor=self.executor,
+                                 index=self.index,
+                                 streams=self.streams, verify=self.verify,
+                                 dest_index=self.dest_index,
+                                 dest_snapshot=self.dest_snapshot,
+                                 dedupe=self.dedupe, profiler=profiler,
+                                 journal=self.journal, shard=self.shard,
+                                 include=self.include, exclude=self.exclude,
+                                 newer_than=self.newer_than, min_size=self.min_size)
             print(f"{self.dry_run=}")
-            fixer.run()
+            if self.plan:
+                with open(self.plan, "w", encoding="utf-8") as out:
+                    fixer.plan(out)
+            elif self.apply:
+                with open(self.apply, encoding="utf-8") as plan:
+                    fixer.apply(plan)
+            elif self.resume:
+                fixer.resume()
+            elif self.undo:
+                fixer.undo()
+            elif self.mode == "watch":
+                from sortmp3.watch import Watcher
+                Watcher(fixer, interval=self.interval, settle=self.settle,
+                        poll=self.poll).run()
+            else:
+                fixer.run()
         except Exception as e:
             logging.error(f"Fixer failed. Reason: {e}")
 
@@ -94,8 +282,12 @@ class CmdFix:
 def main():    
     c = CmdFix(argparse.ArgumentParser())
     c.parse()
-    Full_Log("FixMusicFile", level=c.log_level)
-    c.run()
+    from sortmp3.fullog import Full_Log
+    log = Full_Log("FixMusicFile", level=c.log_level, use_queue=c.log_queue)
+    try:
+        c.run()
+    finally:
+        log.stop()
 
 
 if __name__ == '__main__':
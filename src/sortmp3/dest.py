@@ -0,0 +1,73 @@
+""" Module dest.py - In-memory index of the Music Hierarchy
+    Lists the files already in the outfolder's Music folder once, at startup,
+    or loads them from a snapshot, so that duplicates are found without a stat per file
+"""
+
+import os
+from pathlib import Path
+
+
+class DestIndex:
+    """
+        Set of the files found below root, the Music folder, kept up to date as files
+        are moved. Paths are stored relative to root. folders holds the folders met
+        while listing root.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.prefix = os.fspath(self.root) + os.sep
+        self.files = set()
+        self.folders = set()
+
+    def rel(self, path):
+        """ path relative to root, None when path is not below root """
+        path = os.fspath(path)
+        return path[len(self.prefix):] if path.startswith(self.prefix) else None
+
+    def build(self):
+        """ lists the files below root """
+        stack = [os.fspath(self.root)]
+        while stack:
+            folder = stack.pop()
+            try:
+                with os.scandir(folder) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            self.folders.add(Path(folder))
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    self.files.add(entry.path[len(self.prefix):])
+        return self
+
+    def load(self, snapshot):
+        """ reads the files listed in snapshot, one relative path per line """
+        with open(snapshot, encoding="utf-8", errors="surrogateescape") as f:
+            self.files = {line.rstrip("\n") for line in f}
+        return self
+
+    def save(self, snapshot):
+        """ writes the files to snapshot, one relative path per line """
+        tmp = Path(snapshot).with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8", errors="surrogateescape") as f:
+            for rel in sorted(self.files):
+                f.write(rel + "\n")
+        os.replace(tmp, snapshot)
+
+    def __contains__(self, path):
+        return self.rel(path) in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def moved(self, source, target):
+        """ keeps the index up to date once source has been moved to target """
+        rel = self.rel(source)
+        if rel is not None:
+            self.files.discard(rel)
+        rel = self.rel(target)
+        if rel is not None:
+            self.files.add(rel)
@@ -0,0 +1,53 @@
+""" Module dirs.py - Target directory planner
+    Builds the Artist/Album folders of the Music Hierarchy once per run:
+    sanitized names are memoized and each folder is created at most once
+"""
+
+from pathlib import Path
+
+
+class DirPlanner:
+    """
+        Resolves and creates the target folders below root, the Music folder.
+        clean is the function turning an artist or album name into a folder name.
+        Counters tell how many mkdir calls were made and how many were avoided.
+    """
+
+    # bound of the memo of sanitized names
+    MAXSIZE = 65536
+
+    def __init__(self, root, clean):
+        self.root = Path(root)
+        self.clean = clean
+        self.names = {}
+        # folders known to exist
+        self.known = set()
+        self.mkdirs = 0
+        self.avoided = 0
+
+    def component(self, name):
+        """ folder name for an artist or album name """
+        try:
+            return self.names[name]
+        except KeyError:
+            if len(self.names) >= self.MAXSIZE:
+                self.names.clear()
+            folder = self.names[name] = self.clean(name)
+            return folder
+
+    def target_dir(self, artist, album):
+        """ the folder of album by artist """
+        return self.root / self.component(artist) / self.component(album)
+
+    def ensure(self, folder):
+        """ creates folder and its parents unless known to exist """
+        if folder in self.known:
+            self.avoided += 1
+            return
+        folder.mkdir(parents=True, exist_ok=True)
+        self.mkdirs += 1
+        self.known.add(folder)
+
+    def reset(self):
+        """ forgets the folders known to exist, e.g. after folders were removed """
+        self.known.clear()
@@ -0,0 +1,85 @@
+""" Module fingerprint.py - Audio payload fingerprints
+    Hashes the audio of a music file, leaving its tags out, so that the same recording
+    is recognized whatever its tags. Fingerprints are cached by path, size and mtime.
+"""
+
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+from sortmp3.index import INDEX_DIR
+from sortmp3.formats import HANDLERS
+
+CHUNK = 1 << 20
+
+CACHE_NAME = "fingerprints.db"
+
+
+def fingerprint(path, filtyp):
+    """ hex digest of the audio payload of path; the whole file when its format is
+        unknown """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        handler = HANDLERS.get(filtyp)
+        if handler is None or handler.spans is None:
+            spans = [(0, size)]
+        else:
+            spans = handler.spans(f, size)
+        for start, end in spans:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(CHUNK, remaining))
+                if not chunk:
+                    break
+                h.update(chunk)
+                remaining -= len(chunk)
+    return h.hexdigest()
+
+
+class FingerprintCache:
+    """ SQLite cache of fingerprints, valid as long as a file keeps its size and
+        mtime """
+
+    def __init__(self, db_path, batch=1000):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS fingerprints ("
+                        "path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                        "mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL)")
+        self.batch = batch
+        self.pending = 0
+
+    @classmethod
+    def under(cls, outfolder):
+        return cls(Path(outfolder, INDEX_DIR, CACHE_NAME))
+
+    def lookup(self, path, st):
+        row = self.db.execute(
+            "SELECT digest FROM fingerprints WHERE path=? AND size=? AND mtime_ns=?",
+            (os.fspath(path), st.st_size, st.st_mtime_ns)).fetchone()
+        return None if row is None else row[0]
+
+    def record(self, path, digest, source=None):
+        """ records the digest of the file now at path, moved from source if given """
+        st = os.stat(path)
+        if source is not None:
+            self.db.execute("DELETE FROM fingerprints WHERE path=?",
+                            (os.fspath(source),))
+        self.db.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)",
+                        (os.fspath(path), st.st_size, st.st_mtime_ns, digest))
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
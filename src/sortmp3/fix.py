@@ -7,11 +7,96 @@ import sys
 import os
 from pathlib import Path
 import logging
-from mutagen import File
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3NoHeaderError
-import re
-import shutil
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from typing import NamedTuple
+from sortmp3.scan import scan_music_files, shard_of, music_match, WalkFilter
+from sortmp3.index import ScanIndex
+from sortmp3.mover import Mover
+from sortmp3.formats import read_tags, open_tags, handler_for
+from sortmp3.dirs import DirPlanner
+from sortmp3.dest import DestIndex
+from sortmp3.fingerprint import fingerprint, FingerprintCache
+from sortmp3.profiling import NULL_PROFILER
+from sortmp3.journal import Journal, journal_path, read_journal, entry_at
+from sortmp3.names import sanitize, normalize_spaces, title_case  # noqa: F401
+
+
+def ordered_map(executor, fn, iterable, window):
+    """
+        Like executor.map(fn, *args) for each args in iterable, but results are yielded
+        in order while at most window tasks are pending, so a lazy iterable stays lazy
+    """
+    pending = deque()
+    for args in iterable:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def chunked(iterable, size):
+    """ yields lists of at most size items taken from iterable """
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def log_tags(label, tags):
+    """ logs artist, album and title of tags, only built when debugging """
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug("%s: %s", label,
+                      " * ".join([tags[it] for it in FixMusicFile.ITEMS]))
+
+
+#
+# per process state of the process pool: the fixer is sent once, when the worker starts
+#
+_worker = None
+
+
+def _init_worker(fixer):
+    global _worker
+    _worker = fixer
+
+
+def _decide_chunk(chunk):
+    """ runs in a worker process: one compact decision per candidate of chunk """
+    return [_worker.decide(*candidate) for candidate in chunk]
+
+
+class Decision(NamedTuple):
+    """ what is to be done with a music file """
+    source: Path
+    target_dir: Path
+    target: Path
+    # tags as found in the file
+    tags_before: dict
+    tags_after: dict
+    # tags in the file differ from tags_after and have to be written
+    retag: bool = True
+    # fingerprint of the audio payload, when duplicates are found by content
+    digest: str = None
+
+
+class Result(NamedTuple):
+    """ what process() did with a file """
+    source: Path
+    # move, keep (already in place), duplicate, error,
+    # or skip (not a music file of this shard)
+    action: str
+    target: Path = None
+    # where the file is now
+    final: Path = None
+    tags_before: dict = None
+    tags_after: dict = None
+    error: str = None
+    # seconds spent deciding (tags read, merged and saved) and placing the file
+    timings: dict = None
 
 
 def dir_empty(dir_path):
@@ -28,39 +113,75 @@ def clean_dirs(root: Path) -> int:
     """
     Supprime tous les dossiers vides de manière récursive.
     Retourne le nombre de dossiers supprimés.
+    Folders removed or filled meanwhile, e.g. by another shard, are skipped.
     """
     removed = 0
     # loop on subfolders
-    for child in list(root.iterdir()):
-        print(f"Checkin child {child}")
+    try:
+        children = list(root.iterdir())
+    except FileNotFoundError:
+        return removed
+    for child in children:
+        logging.debug("Checking child %s", child)
         #
         # clean child folders' content first
         #
         if child.is_dir():
-            print(f"{child} is dir")
-            if dir_empty(child):
-                child.rmdir()
-                removed += 1
-            else:
-                removed += clean_dirs(child)
+            removed += clean_dirs(child)
             #
             # clean child itself
             #
-            if dir_empty(child):
+            try:
                 child.rmdir()
+            except OSError:
+                # not empty, or removed meanwhile
+                pass
+            else:
                 removed += 1
     return removed
 
 
+def clean_parents(folders, root: Path) -> int:
+    """
+        Removes the empty folders among folders and their ancestors, bottom-up,
+        stopping at the first non-empty one. root itself is never removed.
+        Returns the number of removed folders.
+    """
+    removed = 0
+    root = Path(root)
+    # deepest folders first so that children go before their parents
+    for folder in sorted({Path(f) for f in folders}, key=lambda f: len(f.parts),
+                         reverse=True):
+        while folder != root and root in folder.parents:
+            try:
+                os.rmdir(folder)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # not empty
+                break
+            else:
+                removed += 1
+            folder = folder.parent
+    return removed
+
+
 class FixMusicFile():
 
     ITEMS = "artist album title".split()
 
+    DEFAULTS = {"album": "Single", "artist": "Unknown artist", "title": "Unknown title"}
+
     def __init__(self, infolder='.', outfolder='.', errfolder=None,
                  artist="Tag", album="Tag", title="Tag",
-                 dry_run=True, overwrite=False):
+                 dry_run=True, overwrite=False, jobs=1, executor="thread",
+                 chunk_size=64, index=False, streams=1, verify=False,
+                 dest_index=False, dest_snapshot=None,
+                 dedupe=False, profiler=None, journal=False, shard=None,
+                 include=(), exclude=(), newer_than=None, min_size=None):
 
-        # a bunch of files and folders among them music files in mp3 or m4a format
+        # a bunch of files and folders among them music files in a registered format:
+        # mp3, m4a, flac, ogg, opus
         self.infolder = Path(infolder).expanduser().resolve()
 
         # a place where the Music Hierarchy lives
@@ -79,10 +200,205 @@ class FixMusicFile():
         self.dry_run = dry_run
         self.overwrite = overwrite
 
+        # number of workers for tag load, merge and save
+        self.jobs = max(1, int(jobs))
+
+        # workers are threads or processes;
+        # processes receive candidates chunk_size at a time
+        if executor not in {"thread", "process"}:
+            raise ValueError(f"Unknown executor: {executor}")
+        self.executor = executor
+        self.chunk_size = max(1, int(chunk_size))
+
+        # keep tags of processed files in outfolder/.sortmp3/index.db
+        # to skip parsing them next time
+        self.use_index = index
+        self.index = None
+
+        # with shard (i, n), only the files of shard i (from 1 to n) of the infolder
+        # are processed, other shards being processed at the same time,
+        # e.g. by other machines
+        if shard is not None and not 1 <= shard[0] <= shard[1]:
+            raise ValueError(f"Invalid shard: {shard[0]}/{shard[1]}")
+        self.shard = shard
+
+        # moves run on streams concurrent copy streams, copies across devices
+        # may be verified; targets are taken atomically when other shards
+        # may take them too
+        self.mover = Mover(streams=streams, verify=verify,
+                           exclusive=shard is not None and not overwrite)
+        self._moving = deque()
+
+        # resolves and creates the Artist/Album folders of the Music Hierarchy
+        self.dirs = DirPlanner(Path(self.outfolder, "Music"), sanitize)
+
+        # the scanner does not walk down the Music Hierarchy when it lies inside
+        # the infolder, nor folders excluded by glob patterns;
+        # files may also be filtered by name, size and mtime
+        music = self.dirs.root
+        prune = ()
+        if music != self.infolder and music.is_relative_to(self.infolder):
+            prune = (music,)
+        self.walk = WalkFilter(self.infolder, prune=prune, include=include,
+                               exclude=exclude, newer_than=newer_than,
+                               min_size=min_size)
+
+        # folders that files were moved from: the only ones cleaned after a run
+        self.touched = set()
+
+        # duplicates are found in an in-memory list of the Music Hierarchy,
+        # built at startup or loaded from dest_snapshot when it exists;
+        # the snapshot is saved after a real run
+        self.use_dest = dest_index or dest_snapshot is not None
+        self.dest_snapshot = dest_snapshot
+        self.dest = None
+
+        # duplicates are found by audio fingerprint, whatever their tags;
+        # fingerprints are cached in outfolder/.sortmp3/fingerprints.db,
+        # library maps those of the Music Hierarchy to paths
+        self.dedupe = dedupe
+        self.fingerprints = None
+        self.library = None
+
+        # actions are journaled in outfolder/.sortmp3/journal.jsonl before they
+        # are done, so that a run can be resumed or undone;
+        # tags are then saved once journaled
+        self.use_journal = journal
+        self.journal = None
+        self.resuming = False
+
+        # called with each decision, where its file is now, the action taken
+        # (move, keep, duplicate or error) and the error message, if any
+        self.on_placed = None
+
+        # stage timers and counters, doing nothing unless a Profiler is given
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+
     def __repr__(self):
         attrs = ", ".join(f"{k}={v!r}" for k, v in vars(self).items())
         return f"{self.__class__.__name__}({attrs})"
 
+    def decide(self, file, groups, cached=None, digest=None, write=None):
+        """
+            Reads the tags of file, merges them with the info found in its path
+            and returns a Decision. Tags are saved here unless dry_run.
+            groups are the (artist, title, filtyp) groups matched by the scanner.
+            cached are the tags known from the scan index, if any. Otherwise tags are
+            read from the file header; mutagen is only used when this is not possible
+            or when tags have to be written.
+            digest is the cached fingerprint of file, computed here when missing
+            and dedupe is on.
+            With write False, tags are left for retag() to save,
+            as they are by default when journaled.
+
+            This is the per-file unit of work that may run in a worker thread.
+        """
+        if write is None:
+            write = not self.use_journal
+        logging.debug("Processing %s", file.name)
+        profiler = self.profiler
+        fil_ = self.file_info(file, groups)
+        filtyp = groups[2].strip().lower()
+        cached, audiofile = self.file_tags(file, filtyp, cached)
+        with profiler.stage("merge"):
+            tag_ = {it: sanitize(cached[it]) for it in FixMusicFile.ITEMS}
+            log_tags("Original tags", tag_)
+            #
+            # merge fil and tag info into new tags consistently with priorities
+            # Note that Tags are modified inplace before file is moved
+            #
+            new_ = self.merge(fil_, tag_)
+        self.write_tags(file, filtyp, audiofile, new_, new_ != cached,
+                        write and not self.dry_run)
+        #
+        # create folder path and filename
+        #
+        target_dir = self.dirs.target_dir(new_["artist"], new_["album"])
+        ext = handler_for(filtyp).ext
+        filename = new_["artist"] + " - " + new_["title"] + "." + ext
+        if self.dedupe and digest is None:
+            with profiler.stage("fingerprint"):
+                digest = fingerprint(file, filtyp)
+            if profiler.enabled:
+                profiler.count("bytes read", os.path.getsize(file))
+        return Decision(file, target_dir, target_dir / sanitize(filename), cached, new_,
+                        new_ != cached, digest)
+
+    def file_info(self, file, groups):
+        """ artist, title and album found in the path of file, groups being
+            the (artist, title, filtyp) groups matched by the scanner """
+        fil_ = {}
+        fil_["artist"] = title_case(groups[0])
+        fil_["title"] = title_case(groups[1])
+        # get last folder and beware of trailing slashes
+        fil_["album"] = file.parent.name
+        if self.infolder.name == fil_["album"]:
+            fil_["album"] = ""
+        log_tags("File info", fil_)
+        return fil_
+
+    def file_tags(self, file, filtyp, cached=None):
+        """ (tags, audiofile): the tags of file, cached or read from its header,
+            and its tags opened with mutagen when they had to be, None otherwise """
+        audiofile = None
+        if cached is None:
+            # header-only fast path
+            with self.profiler.stage("read"):
+                cached = read_tags(file, filtyp)
+        if cached is None:
+            with self.profiler.stage("parse"):
+                audiofile = self.load(file, filtyp)
+            # Some tags may be missing, so we use .get(key, [""])[0]
+            cached = {it: audiofile.get(it, [""])[0] for it in FixMusicFile.ITEMS}
+        return cached, audiofile
+
+    def write_tags(self, file, filtyp, audiofile, new_, changed, write):
+        """ sets the new tags on audiofile, the open tags of file, and saves them
+            when write; file is only opened here when its tags changed and
+            are to be saved """
+        if audiofile is None:
+            if not (changed and write):
+                return
+            with self.profiler.stage("parse"):
+                audiofile = self.load(file, filtyp)
+        for it in FixMusicFile.ITEMS:
+            audiofile[it] = new_[it]
+        log_tags("Modified tags", new_)
+        if write:
+            with self.profiler.stage("save"):
+                audiofile.save()
+            if self.profiler.enabled:
+                # tags are rewritten in place, the whole file at worst
+                self.profiler.count("bytes written", os.path.getsize(file))
+
+    def retag(self, decision):
+        """ saves the new tags of a decision made without writing them,
+            unless dry_run """
+        if not decision.retag or self.dry_run:
+            return
+        source = decision.source
+        with self.profiler.stage("parse"):
+            audiofile = self.load(source, source.suffix[1:].lower())
+        for it in FixMusicFile.ITEMS:
+            audiofile[it] = decision.tags_after[it]
+        with self.profiler.stage("save"):
+            audiofile.save()
+
+    def load(self, file, filtyp):
+        """ opens the tags of file, in its own format """
+        return open_tags(file, filtyp)
+
+    def merge(self, fil_, tag_):
+        """ merges file info and tag info into new tags consistently with priorities
+            a default value is used when both are vacant """
+        new_ = {}
+        for it, default in FixMusicFile.DEFAULTS.items():
+            if self.priority[it] == "File":
+                new_[it] = fil_[it] or tag_[it] or default
+            else:
+                new_[it] = tag_[it] or fil_[it] or default
+        return new_
+
     def run(self):
         """
             Music Tags are modified depending on available info and priority
@@ -92,145 +408,633 @@ class FixMusicFile():
             Present         File    Priority
 
             Filenames reflect Music Tags when file is put in its place in the Music Hierarchy
-            with Artist - Title.mp3 or m4a syntax
+            with Artist - Title.ext syntax, ext a registered format
 
-        """
-        def sanitize(s):
-            """ Replaces illegal (windows, POSIX) chars in filenames with _"""
-            return normalize_spaces(re.sub(r'[<>:"/\\|?*\x00-\x1F]', ' ', s)[:255])
-
-
-        def normalize_spaces(text):
-            """ substitutes multiple space chars by one char.
-                eliminates leading and trailng spaces"""
-            text = re.sub(r'\s+', ' ', text)
-            return text.strip()
+            With jobs > 1, tags are loaded, merged and saved on a pool of threads
+            while folder creation and moves are applied one at a time, in scan order.
+            With executor="process", candidates are sent in chunks to a pool
+            of processes which return decisions; moves are still applied here,
+            in scan order.
 
+        """
         n = 0
         logging.info(f"Starting exploring music files in {self.infolder}")
-        initial_folder_name = self.infolder.name
-        logging.debug(f"{initial_folder_name=}")
+        logging.debug(f"{self.outfolder=}")
         #
         # To allow inplace processing when infolder and outfolder are the same
+        # files already put in the Music Hierarchy during this run
+        # are skipped by the scanner
         #
-        files = list(self.infolder.rglob("*"))
-        #
-        # retain files only
-        #
-        files = [f for f in files if f.is_file()]
-        for file in files:
-                # Strict regex: artist space hyphen space title.mp3 or m4a
-                match = re.match(r'^(.+?) - (.+?)\.(mp3|m4a)$', file.name)
-                if not match:
-                    continue
-                logging.debug(f"Processing {file.name}")
+        placed = set()
+        self.begin()
+        try:
+            if self.resuming:
+                n += self.replay(placed)
+            for decision in self.decisions(skip=placed):
                 n += 1
-                #
-                # collect info from file system
-                #
-                fil_ = {}
-                fil_["artist"] = match.group(1).strip().title()
-                fil_["title"] = match.group(2).strip().title()
-                filtyp = match.group(3).strip().lower()
-                # get last folder and beware of trailing slashes
-                fil_["album"] = file.parent.name
-                if initial_folder_name == fil_["album"]:
-                    fil_["album"] = ""
-                temp = " * ".join([fil_[it] for it in FixMusicFile.ITEMS])
-                logging.debug(f"File info: {temp}")
-                #
-                # collect info from tags
-                #
-                try:
-                    # easy=True for a unified dict-like interface
-                    audiofile = File(file, easy=True)                    
-                    assert filtyp=="mp3" and isinstance(audiofile, EasyID3), "mp3 audiofile is not an EasyID3"
-                except (AssertionError, ID3NoHeaderError) :
-                    audiofile = EasyID3()
-                    audiofile.save(file)
-                    audiofile = EasyID3(file)
-
-                if audiofile is None:
-                    raise ValueError(f"Unsupported file type: {file}")
-                #
-                # Some tags may be missing, so we use .get(key, [""])[0]
-                tag_ = {}
-                for it in FixMusicFile.ITEMS:
-                    tag_[it] = sanitize(audiofile.get(it, [""])[0])
-                temp = " * ".join([tag_[it] for it in FixMusicFile.ITEMS])
-                logging.debug(f"Original tags: {temp}")
-                # merge fil and tag info into new tags consistently with priorities
-                #
-                # album
-                #
-                if self.priority["album"] == "File":
-                    audiofile["album"] = fil_[
-                        "album"] or tag_["album"] or "Single"
-                else:
-                    audiofile["album"] = tag_[
-                        "album"] or fil_["album"] or "Single"
-                #
-                # artist
-                #
-                if self.priority["artist"] == "File":
-                    audiofile["artist"] = fil_["artist"] or tag_[
-                        "artist"] or "Unknown artist"
-                else:
-                    audiofile["artist"] = tag_["artist"] or fil_[
-                        "artist"] or "Unknown artist"
-                #
-                # title
-                #
-                if self.priority["title"] == "File":
-                    audiofile["title"] = fil_["title"] or tag_[
-                        "title"] or "Unknown title"
-                else:
-                    audiofile["title"] = tag_["title"] or fil_[
-                        "title"] or "Unknown title"
-                #
-                # Note that Tags are modified inplace before file is moved
-                #
-                temp = " * ".join([audiofile.get(it, ["***"])[0]
-                                for it in FixMusicFile.ITEMS])
-                logging.debug(f"Modified tags: {temp}")
-                if not self.dry_run:
-                    audiofile.save()
-                #
-                # create folder path
-                #
-                logging.debug(f'{self.outfolder=}')
-                logging.debug(f'{audiofile["artist"]=}')
-                logging.debug(f'{audiofile["album"]=}')
-                #
-                target_dir = Path(self.outfolder, "Music", sanitize(
-                    audiofile["artist"][0]), sanitize(audiofile["album"][0]))
+                final = self.place(decision)
+                if final != decision.source:
+                    placed.add(str(final))
+            # folders are cleaned once all moves are done
+            self.settle_moves(wait=True)
+            p = self.clean_touched()
+        finally:
+            self.finish()
+        logging.info(f"Files processed: {n}")
+        if p:
+            logging.info(f"Folders cleaned: {p}")
+        return n
+
+    def decisions(self, skip=()):
+        """ yields one Decision per music file found in the infolder, in scan order,
+            using the pool of workers set up by jobs and executor """
+        found = scan_music_files(self.infolder, skip=skip, walk=self.walk)
+        candidates = ((file, match.groups())
+                      for file, match in self.profiler.timed("scan", found)
+                      if self.mine(file))
+        if self.index is not None or self.fingerprints is not None:
+            candidates = (self.known(file, groups) for file, groups in candidates)
+        if self.executor == "process":
+            # worker startup is paid once per run
+            # multiprocessing is only loaded when used
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor(max_workers=self.jobs,
+                                       initializer=_init_worker, initargs=(self,))
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.jobs)
+        with pool:
+            if self.executor == "process":
+                chunks = ((chunk,) for chunk in chunked(candidates, self.chunk_size))
+                yield from chain.from_iterable(
+                    ordered_map(pool, _decide_chunk, chunks, window=2 * self.jobs))
+            elif self.jobs > 1:
+                yield from ordered_map(pool, self.decide, candidates,
+                                       window=4 * self.jobs)
+            else:
+                yield from (self.decide(*c) for c in candidates)
+
+    def process(self, paths):
+        """
+            Fixes the files at paths, any iterable of paths, e.g. a batch of new
+            files, without walking the infolder. Yields one Result per path, lazily
+            and in order, once its file is in its final place. Errors are reported
+            in the Result of their file instead of being raised.
+        """
+        outcomes = {}
+        waiting = deque()
+
+        def placed(decision, *outcome):
+            outcomes[id(decision)] = outcome
+        self.on_placed = placed
+        self.begin()
+        try:
+            for path in paths:
+                waiting.append(self._process(Path(path)))
+                yield from self._results(waiting, outcomes)
+            self.settle_moves(wait=True)
+            yield from self._results(waiting, outcomes)
+            self.clean_touched()
+        finally:
+            self.on_placed = None
+            self.finish()
+
+    def _process(self, file):
+        """ a Result, or (decision, timings) for a file whose move may not be done
+            yet """
+        match = music_match(file.name)
+        if not match or not self.mine(file) or not self.walk.admits(file):
+            return Result(file, "skip")
+        start = time.perf_counter()
+        try:
+            cached = None if self.index is None else self.index.lookup(file,
+                                                                       os.stat(file))
+            decision = self.decide(file, match.groups(), cached)
+        except Exception as e:
+            return Result(file, "error", error=str(e),
+                          timings={"decide": time.perf_counter() - start})
+        decided = time.perf_counter()
+        try:
+            self.place(decision)
+        except Exception as e:
+            self.on_placed(decision, decision.source, "error", str(e))
+        return decision, {"decide": decided - start,
+                          "place": time.perf_counter() - decided}
+
+    def _results(self, waiting, outcomes):
+        """ yields the Results at the head of waiting whose outcome is known """
+        while waiting:
+            if isinstance(waiting[0], Result):
+                yield waiting.popleft()
+                continue
+            decision, timings = waiting[0]
+            outcome = outcomes.pop(id(decision), None)
+            if outcome is None:
+                # still moving
+                return
+            waiting.popleft()
+            final, action, error = outcome
+            yield Result(decision.source, action, decision.target, final,
+                         decision.tags_before, decision.tags_after, error, timings)
+
+    def mine(self, file):
+        """ True when file belongs to the shard of this run """
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        return shard_of(file, self.infolder, count) == index - 1
+
+    def known(self, file, groups):
+        """ candidate completed with what the caches know about file: tags and
+            fingerprint """
+        st = os.stat(file)
+        cached = None if self.index is None else self.index.lookup(file, st)
+        digest = (None if self.fingerprints is None
+                  else self.fingerprints.lookup(file, st))
+        return file, groups, cached, digest
+
+    def fingerprint_library(self):
+        """ fingerprints of the music files in the Music Hierarchy, digest -> path
+            cached ones are reused, the others are computed by jobs threads """
+        library = {}
+        missing = []
+        for file, match in scan_music_files(self.dirs.root):
+            digest = self.fingerprints.lookup(file, os.stat(file))
+            if digest is None:
+                missing.append((file, match.group(3).lower()))
+            else:
+                library.setdefault(digest, str(file))
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            digests = ordered_map(pool, fingerprint, missing, window=4 * self.jobs)
+            for (file, filtyp), digest in zip(missing, digests):
+                self.fingerprints.record(file, digest)
+                library.setdefault(digest, str(file))
+        logging.info(f"Fingerprints in the Music Hierarchy: {len(library)}, "
+                     f"computed: {len(missing)}")
+        return library
+
+    def duplicate_of(self, decision):
+        """ the file of the Music Hierarchy holding the same audio as decision.source,
+            if any; none when the audio of decision.source is unknown """
+        if self.library is None or decision.digest is None:
+            return None
+        other = self.library.get(decision.digest)
+        return None if other is None or other == str(decision.source) else other
+
+    def free_name(self, target, taken=()):
+        """ target, or the first target (2), target (3)... not yet taken """
+        k = 1
+        candidate = target
+        while candidate in taken or self.exists(candidate):
+            k += 1
+            candidate = target.with_name(f"{target.stem} ({k}){target.suffix}")
+        return candidate
+
+    def resolve(self, decision, taken=None):
+        """ (target, action): where the file of decision goes and what is done with it,
+            keep, duplicate or move. taken holds the targets claimed by the files
+            planned so far, when nothing is moved meanwhile; plain dry runs do not look
+            for taken targets otherwise """
+        if decision.target == decision.source:
+            logging.debug("Already in place: %s", decision.target.name)
+            return decision.source, "keep"
+        other = self.duplicate_of(decision)
+        if other is not None:
+            logging.warning("Duplicate audio ignored: %s is %s",
+                            decision.source.name, other)
+            return decision.source, "duplicate"
+        target = decision.target
+        if (taken is None and self.dry_run and self.dest is None
+                and self.library is None):
+            return target, "move"
+        taken = taken or ()
+        if not self.overwrite and (target in taken or self.exists(target)):
+            if self.library is None:
+                logging.warning("Duplicate ignored: %s", target.name)
+                return decision.source, "duplicate"
+            # not the same audio: another recording with the same name
+            target = self.free_name(target, taken)
+            logging.info("Name taken, moving to %s", target.name)
+        if self.library is not None and decision.digest is not None:
+            self.library[decision.digest] = str(target)
+        return target, "move"
+
+    def plan(self, out):
+        """
+            Writes to the text stream out the plan of what run() would do, one JSON
+            object per line: source, size and mtime_ns of the source, target,
+            tags_before, tags_after, retag, digest and action.
+            Action is "move", "keep" when the file is already in place, or "duplicate".
+            Targets and actions are the ones run() would take, as told by resolve().
+            Nothing is changed. Returns the number of planned files.
+        """
+        n = 0
+        # nothing is written while planning
+        dry_run, self.dry_run = self.dry_run, True
+        planned = set()
+        logging.info(f"Planning music files in {self.infolder}")
+        self.begin()
+        try:
+            for decision in self.decisions():
+                n += 1
+                st = os.stat(decision.source)
+                target, action = self.resolve(decision, planned)
+                if action != "duplicate":
+                    planned.add(target)
+                out.write(json.dumps({
+                    "source": str(decision.source), "size": st.st_size,
+                    "mtime_ns": st.st_mtime_ns, "target": str(target),
+                    "tags_before": decision.tags_before,
+                    "tags_after": decision.tags_after, "retag": decision.retag,
+                    "digest": decision.digest, "action": action}) + "\n")
+        finally:
+            self.finish()
+            self.dry_run = dry_run
+        logging.info(f"Files planned: {n}")
+        return n
+
+    def catalog(self):
+        """ decides for every music file of the infolder, changing nothing,
+            and returns the decisions as a compact Catalog """
+        from sortmp3.records import Catalog
+        catalog = Catalog(self.infolder)
+        dry_run, self.dry_run = self.dry_run, True
+        self.begin()
+        try:
+            for decision in self.decisions():
+                catalog.add(decision)
+        finally:
+            self.finish()
+            self.dry_run = dry_run
+        logging.info(f"Files in catalog: {len(catalog)}, "
+                     f"shared strings: {len(catalog.strings)}")
+        return catalog
+
+    def apply(self, plan):
+        """
+            Executes a plan written by plan(), given as an iterable of JSON lines.
+            Files are not parsed again: a planned file is only checked to still have the
+            size and mtime it had when planned, and skipped otherwise.
+            Returns the number of applied entries.
+        """
+        n = 0
+        stale = 0
+        logging.info(f"Applying plan to {self.infolder}")
+        self.begin()
+        try:
+            for line in plan:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                source = Path(entry["source"])
                 try:
-                    target_dir.mkdir(parents=True, exist_ok=True)
-                except OSError as e:
-                    logging.error(f"Cannot create folder path {target_dir=}")
-                    logging.error(f"Cause: {e}")
+                    st = os.stat(source)
+                except FileNotFoundError:
+                    st = None
+                if st is None or ((st.st_size, st.st_mtime_ns)
+                                  != (entry["size"], entry["mtime_ns"])):
+                    logging.warning("Stale plan entry skipped: %s", source)
+                    stale += 1
                     continue
-                #
-                # create filename
-                #
-                filename = audiofile["artist"][0] + " - " + \
-                    audiofile["title"][0] + "." + filtyp
-                target_file = target_dir / sanitize(filename)
-                logging.info(f"Moving to {target_file.name}")
-                #
-                # move mp3 file to its final place
-                #
-                if not self.dry_run:
-                    if target_file.exists() and target_file.is_file() and not self.overwrite:
-                        logging.warning(f"Duplicate ignored: {target_file.name}")
-                    else:
-                        shutil.move(file, target_file)
-        p = 0 if self.dry_run else clean_dirs(self.infolder)
+                n += 1
+                target = Path(entry["target"])
+                decision = Decision(source, target.parent, target,
+                                    entry["tags_before"], entry["tags_after"],
+                                    entry["retag"], entry.get("digest"))
+                if entry.get("action") == "duplicate":
+                    # retagged where it is, as run() does
+                    logging.warning("Duplicate ignored: %s", target.name)
+                    decision = decision._replace(target_dir=source.parent,
+                                                 target=source)
+                self.place(decision, retag=True)
+            self.settle_moves(wait=True)
+            p = self.clean_touched()
+        finally:
+            self.finish()
         logging.info(f"Files processed: {n}")
+        if stale:
+            logging.warning(f"Stale entries: {stale}")
         if p:
             logging.info(f"Folders cleaned: {p}")
         return n
 
+    def resume(self):
+        """
+            Continues the run recorded in the journal: files planned but not done
+            are placed as planned, without parsing them again; files left in place
+            by the run are skipped; then the infolder is processed as by run().
+            Returns the number of processed files.
+        """
+        logging.info(f"Resuming from {journal_path(self.outfolder)}")
+        self.use_journal = True
+        self.resuming = True
+        try:
+            return self.run()
+        finally:
+            self.resuming = False
+
+    def replay(self, placed):
+        """ places the files planned but not done in the journal, returns their number
+            placed gets the files to be skipped by the scanner; files already moved
+            when the run died are recorded as done """
+        n = 0
+        path = journal_path(self.outfolder)
+        if not path.is_file():
+            return n
+        with open(path, "rb") as f:
+            done, pending = read_journal(f)
+            for offset, source, final in done:
+                if final == source:
+                    placed.add(source)
+            logging.info(f"Journal: {len(done)} done, {len(pending)} pending")
+            for source, offset in pending.items():
+                entry = entry_at(f, offset)
+                target = Path(entry["target"])
+                decision = Decision(Path(source), target.parent, target,
+                                    entry["tags_before"], entry["tags_after"],
+                                    entry["retag"], entry.get("digest"))
+                placed.add(source)
+                if not os.path.exists(source):
+                    if target.is_file():
+                        # moved before its done entry reached the journal
+                        self.record(decision, target)
+                        placed.add(str(target))
+                    else:
+                        logging.warning("Planned file not found: %s", source)
+                    continue
+                n += 1
+                final = self.place(decision)
+                if final != decision.source:
+                    placed.add(str(final))
+        return n
+
+    def undo(self):
+        """
+            Replays the journal of the last run backwards: moved files go back
+            where they came from and rewritten tags are restored.
+            Files planned but not done, when the run died, are undone too:
+            their tags may have been rewritten, and they may have been moved.
+            Returns the number of undone files.
+        """
+        path = journal_path(self.outfolder)
+        logging.info(f"Undoing {path}")
+        n = 0
+        emptied = set()
+        with open(path, "rb") as f:
+            done, pending = read_journal(f)
+            # files not done were planned last
+            steps = done + [(offset, source, None)
+                            for source, offset in pending.items()]
+            for offset, source, final in reversed(steps):
+                entry = entry_at(f, offset)
+                if final is None:
+                    final = source if os.path.exists(source) else entry["target"]
+                if self.undo_one(entry, Path(source), Path(final), emptied):
+                    n += 1
+        if not self.dry_run:
+            p = clean_parents(emptied, self.dirs.root)
+            if p:
+                logging.info(f"Folders cleaned: {p}")
+            # a journal is undone once
+            os.replace(path, path.with_name(path.name + ".undone"))
+        logging.info(f"Files undone: {n}")
+        return n
+
+    def undo_one(self, entry, source, final, emptied):
+        """ moves the file of a journal entry back from final to source and restores
+            its tags; emptied gets the folders it leaves. False when it cannot """
+        if final != source:
+            if source.exists() or not final.is_file():
+                logging.warning("Cannot move back %s to %s", final, source)
+                return False
+            logging.info("Moving back to %s", source)
+            if not self.dry_run:
+                source.parent.mkdir(parents=True, exist_ok=True)
+                self.mover.move(final, source)
+                emptied.add(final.parent)
+        if entry["retag"] and not self.dry_run:
+            self.restore_tags(source, entry["tags_before"])
+        return True
+
+    def restore_tags(self, file, tags):
+        """ writes back tags to file, removing those that were missing """
+        audiofile = self.load(file, file.suffix[1:].lower())
+        for it in FixMusicFile.ITEMS:
+            if tags.get(it):
+                audiofile[it] = tags[it]
+            elif it in audiofile:
+                del audiofile[it]
+        audiofile.save()
+
+    def clean_touched(self):
+        """ removes the folders emptied by the moves, and their empty ancestors,
+            up to the infolder; returns the number of removed folders """
+        if self.dry_run or not self.touched:
+            return 0
+        with self.profiler.stage("clean"):
+            p = clean_parents(self.touched, self.infolder)
+        self.touched.clear()
+        if p:
+            # some of them may have been target folders
+            self.dirs.reset()
+        return p
+
+    def begin(self):
+        """ gets ready to place files: scan index and destination index are opened
+            when enabled """
+        # folders may have been cleaned since the last run
+        self.dirs.reset()
+        self.touched.clear()
+        self.profiler.start()
+        self.open_index()
+        if self.use_journal and not self.dry_run and self.journal is None:
+            self.journal = Journal.under(self.outfolder, append=self.resuming)
+        if self.use_dest and self.dest is None:
+            self.dest = DestIndex(self.dirs.root)
+            if self.dest_snapshot and Path(self.dest_snapshot).is_file():
+                self.dest.load(self.dest_snapshot)
+            else:
+                self.dest.build()
+                self.dirs.known.update(self.dest.folders)
+            logging.info(f"Files in the Music Hierarchy: {len(self.dest)}")
+        if self.dedupe and self.fingerprints is None:
+            self.fingerprints = FingerprintCache.under(self.outfolder)
+            self.library = self.fingerprint_library()
+
+    def exists(self, target):
+        """ True when target is already taken in the Music Hierarchy """
+        if self.mover.busy(target):
+            return True
+        if self.dest is not None:
+            return target in self.dest
+        return target.is_file()
+
+    def open_index(self):
+        """ opens the scan index when enabled """
+        if self.use_index and self.index is None:
+            self.index = ScanIndex.under(self.outfolder)
+
+    def finish(self):
+        """ waits for the moves in flight, then reports and closes the index """
+        try:
+            self.settle_moves(wait=True)
+        finally:
+            self.mover.close()
+            self.mover.report()
+            self.close_index()
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            if self.fingerprints is not None:
+                self.fingerprints.close()
+                self.fingerprints = None
+                self.library = None
+            if self.dest is not None:
+                if self.dest_snapshot and not self.dry_run:
+                    self.dest.save(self.dest_snapshot)
+                self.dest = None
+            if self.dirs.mkdirs:
+                logging.info(f"mkdir calls: {self.dirs.mkdirs}, "
+                             f"avoided: {self.dirs.avoided}")
+            if self.profiler.enabled:
+                # copies across devices read and write whole files
+                self.profiler.count("bytes read", self.mover.bytes_copied)
+                self.profiler.count("bytes written", self.mover.bytes_copied)
+                self.profiler.stop()
+                self.profiler.report()
+
+    def close_index(self):
+        if self.index is not None:
+            logging.info(f"Index hits: {self.index.hits}, misses: {self.index.misses}")
+            self.index.close()
+            self.index = None
+
+    def fix_file(self, file):
+        """
+            Fixes a single music file: same merge and move logic as run()
+            returns the path where the file now lives, None if file is not a music file
+        """
+        match = music_match(file.name)
+        if not match or not self.mine(file) or not self.walk.admits(file):
+            return None
+        cached = None if self.index is None else self.index.lookup(file, os.stat(file))
+        return self.place(self.decide(file, match.groups(), cached))
+
+    def place(self, decision, retag=False):
+        """ creates the target folder and moves the file to its final place
+            retag: the new tags of decision are still to be saved, as they are when
+            journaled; returns the path where the file now lives, or will live once
+            its move is done """
+        if self.journal is not None:
+            self.journal.planned(decision)
+            retag = True
+        if retag:
+            self.retag(decision)
+        final, action, error = self._place(decision)
+        if final == decision.source:
+            self.record(decision, final, action, error)
+        else:
+            self.touched.add(decision.source.parent)
+        self.settle_moves()
+        return final
+
+    def record(self, decision, final, action="move", error=None):
+        """ records in the scan index and the fingerprint cache the file now at final
+            action is what was done with it, error why it failed, if it did """
+        if self.on_placed is not None:
+            self.on_placed(decision, final, action, error)
+        if self.dry_run:
+            return
+        if self.journal is not None:
+            self.journal.done(decision, final)
+        if self.index is not None:
+            self.index.record(final, decision.tags_after, decision.target,
+                              source=decision.source)
+        if self.fingerprints is not None and decision.digest is not None:
+            self.fingerprints.record(final, decision.digest, source=decision.source)
+
+    def settle_moves(self, wait=False, limit=None):
+        """ collects the moves that are done, in order, or all of them if wait;
+            with limit, waits for the oldest ones while more than limit are in
+            flight """
+        while self._moving and (wait or self._moving[0][0].done()
+                                or (limit is not None and len(self._moving) > limit)):
+            future, decision, target = self._moving.popleft()
+            try:
+                final = self._moved(future, decision, target)
+            except Exception as e:
+                if self.on_placed is None:
+                    raise
+                self.on_placed(decision, decision.source, "error", str(e))
+                continue
+            # a target taken meanwhile leaves the file where it was
+            action = "move" if final != decision.source else "duplicate"
+            self.record(decision, final, action)
+
+    def _moved(self, future, decision, target):
+        """ where the file of decision is once its move is done """
+        try:
+            return future.result()
+        except FileExistsError:
+            # taken meanwhile, by another shard
+            logging.warning("Duplicate ignored: %s", target.name)
+            return decision.source
+        except FileNotFoundError:
+            if not decision.source.exists() or target.parent.exists():
+                raise
+        # the folder was cleaned meanwhile, by another shard
+        self.dirs.known.discard(target.parent)
+        self.dirs.ensure(target.parent)
+        try:
+            return self.mover.move(decision.source, target)
+        except FileExistsError:
+            logging.warning("Duplicate ignored: %s", target.name)
+            return decision.source
+
+    def _place(self, decision):
+        """ (final, action, error): where the file of decision is, or will be once
+            its move is done, what was done with it, move, keep or duplicate, or what
+            would be done in a dry run, and the error message when it could not be
+            placed """
+        target_file, action = self.resolve(decision)
+        if action != "move":
+            return decision.source, action, None
+        try:
+            with self.profiler.stage("mkdir"):
+                self.dirs.ensure(decision.target_dir)
+        except OSError as e:
+            logging.error(f"Cannot create folder path {decision.target_dir=}")
+            logging.error(f"Cause: {e}")
+            error = f"Cannot create folder {decision.target_dir}"
+            return decision.source, "error", error
+        logging.info("Moving to %s", target_file.name)
+        #
+        # move music file to its final place
+        #
+        if self.dest is not None:
+            # also in dry runs, to catch duplicates within the batch
+            self.dest.moved(decision.source, target_file)
+        if self.dry_run:
+            return decision.source, "move", None
+        with self.profiler.stage("move"):
+            future = self.mover.submit(decision.source, target_file)
+        self._moving.append((future, decision, target_file))
+        return target_file, "move", None
+
+    def __getstate__(self):
+        """ what is sent to worker processes: the scan index and the mover stay here """
+        state = vars(self).copy()
+        state["index"] = None
+        state["mover"] = None
+        state["dest"] = None
+        state["fingerprints"] = None
+        state["journal"] = None
+        state["on_placed"] = None
+        state["library"] = None
+        state["_moving"] = deque()
+        # stages timed in worker processes are not reported
+        state["profiler"] = NULL_PROFILER
+        return state
+
 
 def main():
     from src.sortmp3.fullog import Full_Log
@@ -0,0 +1,111 @@
+""" Module formats.py - Registry of music file formats
+    A format is handled by a Handler registered under the lowercase extension of its
+    files: its fast header reader, its tag opener, the extension given to fixed files
+    and where its audio lies for fingerprints. The extension alone decides the
+    handler, with a dict lookup: files are never read to guess their format.
+    Tags are opened with the mutagen class of the format, so that each file is opened
+    once and saved at most once, in its own format.
+    The mutagen modules of a format are only imported when a file of that format is
+    opened.
+
+    Adding a format is registering a handler:
+
+        register("wv", Handler(read=None, open=open_wavpack, ext="wv"))
+"""
+
+from typing import Callable, NamedTuple, Optional
+from sortmp3.tagread import read_mapped, read_id3, read_mp4, read_flac, read_ogg
+from sortmp3.tagread import mp3_spans, mp4_spans, flac_spans
+
+
+class Handler(NamedTuple):
+    """
+        How files of a format are handled.
+        read: {artist, album, title} from the file mapped in memory, None when mutagen
+        is needed; None when the format has no fast reader.
+        open: the tags of a file, dict-like with lists of values, saved with save().
+        ext: the extension of fixed files, without dot.
+        spans: (start, end) of the audio of an open file of a given size; the whole
+        file when None.
+    """
+    read: Optional[Callable]
+    open: Callable
+    ext: str
+    spans: Optional[Callable] = None
+
+
+HANDLERS = {}
+
+
+def register(suffix, handler):
+    """ handles the files ending with .suffix, whatever its case, with handler """
+    HANDLERS[suffix.lower()] = handler
+
+
+def handler_for(filtyp):
+    """ the handler of the files of extension filtyp, lowercase """
+    handler = HANDLERS.get(filtyp)
+    if handler is None:
+        raise ValueError(f"Unsupported file type: {filtyp}")
+    return handler
+
+
+def read_tags(path, filtyp):
+    """ returns {artist, album, title} read from the header of path, None if not
+        possible """
+    handler = HANDLERS.get(filtyp)
+    if handler is None or handler.read is None:
+        return None
+    return read_mapped(path, handler.read)
+
+
+def open_tags(file, filtyp):
+    """ opens the tags of file with the easy dict-like interface of its format """
+    handler = HANDLERS.get(filtyp)
+    if handler is None:
+        raise ValueError(f"Unsupported file type: {file}")
+    return handler.open(file)
+
+
+def open_mp3(file):
+    """ ID3 tags of an MP3 file; a file without ID3 header gets fresh tags, written
+        on save """
+    from mutagen.easyid3 import EasyID3
+    from mutagen.id3 import ID3NoHeaderError
+    try:
+        return EasyID3(file)
+    except ID3NoHeaderError:
+        tags = EasyID3()
+        tags.filename = str(file)
+        return tags
+
+
+def open_m4a(file):
+    """ iTunes metadata of an MP4/M4A file """
+    from mutagen.easymp4 import EasyMP4
+    return EasyMP4(file)
+
+
+def open_flac(file):
+    """ Vorbis comments of a FLAC file, added on first write when missing """
+    from mutagen.flac import FLAC
+    return FLAC(file)
+
+
+def open_ogg(file):
+    """ Vorbis comments of an Ogg Vorbis file """
+    from mutagen.oggvorbis import OggVorbis
+    return OggVorbis(file)
+
+
+def open_opus(file):
+    """ Vorbis comments of an Ogg Opus file """
+    from mutagen.oggopus import OggOpus
+    return OggOpus(file)
+
+
+register("mp3", Handler(read_id3, open_mp3, "mp3", mp3_spans))
+register("m4a", Handler(read_mp4, open_m4a, "m4a", mp4_spans))
+register("flac", Handler(read_flac, open_flac, "flac", flac_spans))
+register("ogg", Handler(read_ogg, open_ogg, "ogg"))
+register("opus", Handler(read_ogg, open_opus, "opus"))
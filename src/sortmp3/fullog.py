@@ -1,24 +1,54 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import sys
 
 
 class Full_Log:
     """
         setup  full logging in a single call using a kind-of Façade pattern
+
+        With use_queue, the root logger only puts records in a queue: the console and
+        file handlers run on a background listener thread, so that writes and log file
+        rotations do not block the caller. stop() flushes the queue; it is also called
+        at exit.
     """
 
-    def __init__(self, name, level):
+    def __init__(self, name, level, use_queue=False):
         #
         lvl = getattr(logging, level.upper(), logging.INFO)
+        handlers = [
+            logging.StreamHandler(sys.stdout),
+            RotatingFileHandler(name + ".log", maxBytes=100_000,
+                                backupCount=3, encoding="utf-8"),
+        ]
+        self.listener = None
+        if use_queue:
+            formatter = logging.Formatter(
+                "%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+                datefmt="%Y-%m-%d %H:%M:%S")
+            for handler in handlers:
+                handler.setFormatter(formatter)
+            q = queue.SimpleQueue()
+            self.listener = QueueListener(q, *handlers, respect_handler_level=True)
+            handler = QueueHandler(q)
+            # records are formatted once, by the listener handlers
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            handlers = [handler]
         logging.basicConfig(
             level=lvl,
             format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
-            handlers=[
-                logging.StreamHandler(sys.stdout),
-                RotatingFileHandler(name + ".log", maxBytes=100_000,
-                                    backupCount=3, encoding="utf-8"),
-            ],
+            handlers=handlers,
             force=True,  # écrase toute config/handlers existants (Python ≥3.8)
         )
+        if self.listener is not None:
+            self.listener.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """ waits for the queued records to be handled and stops the listener """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
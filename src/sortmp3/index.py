@@ -0,0 +1,84 @@
+""" Module index.py - Persistent scan index for incremental runs
+    Remembers the tags of the music files left in place by previous runs,
+    keyed by path, size and mtime, so that unchanged files need not be parsed again
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+
+INDEX_DIR = ".sortmp3"
+INDEX_NAME = "index.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    artist TEXT NOT NULL,
+    album TEXT NOT NULL,
+    title TEXT NOT NULL,
+    target TEXT NOT NULL
+)
+"""
+
+
+class ScanIndex:
+    """
+        SQLite index of processed music files.
+        A row tells that the file at path, as long as it has this size and mtime,
+        holds these tags and was resolved to this target.
+        Writes are committed every batch rows and on close.
+    """
+
+    def __init__(self, db_path, batch=1000):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(SCHEMA)
+        self.batch = batch
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def under(cls, outfolder):
+        """ the index of the Music Hierarchy in outfolder """
+        return cls(Path(outfolder, INDEX_DIR, INDEX_NAME))
+
+    def lookup(self, path, st):
+        """ returns the tags recorded for path if its size and mtime (os.stat_result st)
+            did not change since, None otherwise """
+        row = self.db.execute(
+            "SELECT artist, album, title FROM files "
+            "WHERE path=? AND size=? AND mtime_ns=?",
+            (os.fspath(path), st.st_size, st.st_mtime_ns)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(zip(("artist", "album", "title"), row))
+
+    def record(self, path, tags, target, source=None):
+        """ records the tags of the file now at path
+            source, if the file was moved from there, is forgotten """
+        st = os.stat(path)
+        if source is not None:
+            self.db.execute("DELETE FROM files WHERE path=?", (os.fspath(source),))
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (os.fspath(path), st.st_size, st.st_mtime_ns,
+             tags["artist"], tags["album"], tags["title"], os.fspath(target)))
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -0,0 +1,99 @@
+""" Module journal.py - Journal of the actions of a run
+    Each file is recorded as planned (source, target, tags before and after) before
+    its tags are written or it is moved, then as done once it is in its final place.
+    The journal is appended to, one JSON object per line, and synced to disk in
+    batches.
+    It lets an interrupted run be resumed, and a run be undone.
+"""
+
+import json
+import os
+from pathlib import Path
+from sortmp3.index import INDEX_DIR
+
+JOURNAL_NAME = "journal.jsonl"
+
+
+def journal_path(outfolder):
+    return Path(outfolder, INDEX_DIR, JOURNAL_NAME)
+
+
+class Journal:
+    """
+        Append-only journal at path. Planned entries are flushed to the OS before the
+        action they announce, and done entries once it is done, so that they survive
+        a crash of the process; the file is synced to disk every batch entries and
+        when closed.
+    """
+
+    def __init__(self, path, batch=1000, append=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = open(self.path, "a" if append else "w", encoding="utf-8")
+        self.batch = batch
+        self.pending = 0
+
+    @classmethod
+    def under(cls, outfolder, append=False):
+        return cls(journal_path(outfolder), append=append)
+
+    def write(self, entry):
+        self.f.write(json.dumps(entry) + "\n")
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.sync()
+
+    def planned(self, decision):
+        """ records what is about to be done to the source of decision """
+        self.write({"op": "planned", "source": str(decision.source),
+                    "target": str(decision.target),
+                    "tags_before": decision.tags_before,
+                    "tags_after": decision.tags_after,
+                    "retag": decision.retag, "digest": decision.digest})
+        self.f.flush()
+
+    def done(self, decision, final):
+        """ records that the source of decision is now at final """
+        self.write({"op": "done", "source": str(decision.source), "final": str(final)})
+        self.f.flush()
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.f.close()
+
+
+def read_journal(f):
+    """
+        Reads the journal opened in binary mode as f.
+        Returns done, the (offset of the planned entry, source, final) of the done
+        files in order, and pending, source -> offset of the planned entry for the
+        files not done. Entries are read again with entry_at(f, offset), so that a
+        long journal is not held in memory.
+    """
+    done = []
+    pending = {}
+    offset = 0
+    for line in f:
+        start = offset
+        offset += len(line)
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # last line cut by a crash
+            break
+        source = entry["source"]
+        if entry["op"] == "planned":
+            pending[source] = start
+        elif entry["op"] == "done" and source in pending:
+            done.append((pending.pop(source), source, entry["final"]))
+    return done, pending
+
+
+def entry_at(f, offset):
+    f.seek(offset)
+    return json.loads(f.readline())
@@ -0,0 +1,193 @@
+""" Module mover.py - Move engine for music files
+    Renames files within a filesystem and copies them with zero-copy system calls
+    across filesystems, optionally verifying the copy before the source is removed
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+CHUNK = 1 << 24
+
+
+def _copy_with(call, size):
+    """ copies up to size bytes with call(offset, count), which returns the number
+        of bytes copied. None when call fails before copying anything """
+    copied = 0
+    try:
+        while copied < size:
+            n = call(copied, min(CHUNK, size - copied))
+            if n == 0:
+                break
+            copied += n
+    except OSError:
+        if copied:
+            raise
+        return None
+    return copied
+
+
+def copy_range(fin, fout, size):
+    """ copies size bytes from fin to fout (file objects) in the kernel when
+        possible """
+    infd, outfd = fin.fileno(), fout.fileno()
+    calls = []
+    if hasattr(os, "copy_file_range"):
+        calls.append(lambda offset, count: os.copy_file_range(infd, outfd, count))
+    if hasattr(os, "sendfile"):
+        calls.append(lambda offset, count: os.sendfile(outfd, infd, offset, count))
+    for call in calls:
+        copied = _copy_with(call, size)
+        if copied is not None:
+            return copied
+    shutil.copyfileobj(fin, fout, CHUNK)
+    return fout.tell()
+
+
+def file_digest(path):
+    """ blake2b digest of the content of path """
+    h = hashlib.blake2b()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.digest()
+
+
+class Mover:
+    """
+        Moves files to their target.
+        Same device: a single rename. Other device: the file is copied to a temporary
+        name next to the target, unique to the move, checked against the source when
+        verify is set, renamed into place and only then the source is removed.
+
+        With streams > 1, moves run concurrently on that many threads: submit() returns
+        a future.
+        Statistics are kept for the final report.
+    """
+
+    def __init__(self, streams=1, verify=False, exclusive=False):
+        self.streams = max(1, int(streams))
+        self.verify = verify
+        # never replace an existing target: FileExistsError is raised instead,
+        # atomically, so that only one of several concurrent writers to a target wins
+        self.exclusive = exclusive
+        self.pool = None
+        # target -> future of the moves in flight
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.renamed = 0
+        self.copied = 0
+        self.bytes_copied = 0
+        self.copy_seconds = 0.0
+
+    def move(self, src, dst):
+        """ moves src to dst, replacing dst if it exists unless exclusive.
+            Returns dst """
+        src, dst = Path(src), Path(dst)
+        if self.same_device(src, dst):
+            self.rename(src, dst)
+            with self.lock:
+                self.renamed += 1
+            return dst
+        start = time.perf_counter()
+        # created exclusively, so that concurrent copies to dst never share it
+        fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=f".{dst.name}.",
+                                   suffix=".part")
+        tmp = Path(tmp)
+        try:
+            with os.fdopen(fd, "wb") as fout, open(src, "rb") as fin:
+                size = os.fstat(fin.fileno()).st_size
+                n = copy_range(fin, fout, size)
+            if n != size:
+                raise OSError(f"Short copy of {src}: {n} bytes out of {size}")
+            shutil.copystat(src, tmp)
+            if self.verify and file_digest(src) != file_digest(tmp):
+                raise OSError(f"Copy of {src} does not match its source")
+            self.rename(tmp, dst)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        os.unlink(src)
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.copied += 1
+            self.bytes_copied += size
+            self.copy_seconds += seconds
+        logging.debug("Copied %d bytes in %.3fs (%.1f MB/s): %s",
+                      size, seconds, size / max(seconds, 1e-9) / 1e6, dst.name)
+        return dst
+
+    def rename(self, src, dst):
+        """ renames src to dst, without replacing dst when exclusive """
+        if not self.exclusive:
+            os.replace(src, dst)
+            return
+        try:
+            # fails if dst exists
+            os.link(src, dst)
+        except FileExistsError:
+            raise
+        except OSError:
+            # no hard links on this filesystem: claim dst by creating it,
+            # then replace it
+            os.close(os.open(dst, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            os.replace(src, dst)
+            return
+        os.unlink(src)
+
+    def same_device(self, src, dst):
+        """ True when src can be renamed to dst """
+        return os.stat(src).st_dev == os.stat(dst.parent).st_dev
+
+    def submit(self, src, dst):
+        """ starts moving src to dst and returns a future.
+            A move to a target still in flight waits for it first """
+        if self.streams == 1:
+            future = Future()
+            try:
+                future.set_result(self.move(src, dst))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.streams)
+        dst = Path(dst)
+        previous = self.inflight.get(dst)
+        if previous is not None:
+            previous.result()
+        future = self.pool.submit(self.move, src, dst)
+        self.inflight[dst] = future
+        future.add_done_callback(partial(self._forget, dst))
+        return future
+
+    def _forget(self, dst, future):
+        if self.inflight.get(dst) is future:
+            del self.inflight[dst]
+
+    def busy(self, dst):
+        """ True when a move to dst is in flight """
+        return Path(dst) in self.inflight
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def report(self):
+        """ logs what has been moved """
+        if not (self.renamed or self.copied):
+            return
+        logging.info(f"Files renamed: {self.renamed}, copied: {self.copied}")
+        if self.copied:
+            mb = self.bytes_copied / 1e6
+            logging.info(f"Bytes copied: {self.bytes_copied} "
+                         f"in {self.copy_seconds:.1f}s, "
+                         f"{mb / max(self.copy_seconds, 1e-9):.1f} MB/s per stream, "
+                         f"{self.copy_seconds / self.copied * 1000:.1f} ms per file")
@@ -0,0 +1,50 @@
+""" Module names.py - Name normalization
+    Cleans artist, album, title and file names with precompiled translation tables.
+    The same few thousand names come back across a library, so results are memoized.
+"""
+
+from functools import lru_cache
+
+# bound of each memo
+MAXSIZE = 65536
+
+# longest file or folder name
+NAME_MAX = 255
+
+# chars illegal in windows or POSIX filenames: <>:"/\|?* and control chars
+ILLEGAL = '<>:"/\\|?*' + "".join(chr(c) for c in range(0x20))
+
+ILLEGAL_TABLE = str.maketrans(dict.fromkeys(ILLEGAL, " "))
+
+
+@lru_cache(maxsize=MAXSIZE)
+def normalize_spaces(text):
+    """ substitutes multiple space chars by one char.
+        eliminates leading and trailng spaces"""
+    # str.split() and re's \s agree on what a space char is
+    return " ".join(text.split())
+
+
+@lru_cache(maxsize=MAXSIZE)
+def sanitize(s):
+    """ Replaces illegal (windows, POSIX) chars in filenames with _"""
+    return normalize_spaces(s.translate(ILLEGAL_TABLE)[:NAME_MAX])
+
+
+@lru_cache(maxsize=MAXSIZE)
+def title_case(s):
+    """ artist or title found in a filename, stripped and title cased """
+    return s.strip().title()
+
+
+def normalize_many(names, fn=sanitize):
+    """ list of fn(name) for each name; repeated names are normalized once """
+    seen = {}
+    out = []
+    for name in names:
+        try:
+            out.append(seen[name])
+        except KeyError:
+            value = seen[name] = fn(name)
+            out.append(value)
+    return out
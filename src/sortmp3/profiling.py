@@ -0,0 +1,136 @@
+""" Module profiling.py - Stage timers and counters
+    Times the stages of a run (scan, tag read, parse, merge, save, mkdir, move, clean)
+    and counts bytes read and written, for a summary at the end of the run.
+    Optionally dumps a cProfile or tracemalloc snapshot.
+    NULL_PROFILER stands in when profiling is off: its timers do nothing.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+def percentile(sorted_values, q):
+    """ nearest-rank percentile of sorted_values, q between 0 and 1 """
+    k = min(len(sorted_values) - 1, max(0, int(q * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+class Profiler:
+    """
+        Collects the duration of each call to a stage, and byte counters.
+        cprofile and tracemalloc are the files where cProfile stats
+        and a tracemalloc snapshot are dumped when the run stops, if given.
+    """
+
+    enabled = True
+
+    def __init__(self, cprofile=None, tracemalloc=None):
+        self.cprofile = cprofile
+        self.tracemalloc = tracemalloc
+        self.durations = defaultdict(list)
+        self.bytes = Counter()
+        self.lock = threading.Lock()
+        self._profile = None
+
+    @contextmanager
+    def stage(self, name):
+        """ times the block as a call to stage name """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # list.append is atomic: stages may be timed from worker threads
+            self.durations[name].append(time.perf_counter() - start)
+
+    def timed(self, name, iterable):
+        """ yields the items of iterable, timing each step as a call to stage name """
+        it = iter(iterable)
+        durations = self.durations[name]
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                durations.append(time.perf_counter() - start)
+                return
+            durations.append(time.perf_counter() - start)
+            yield item
+
+    def count(self, key, n):
+        """ adds n to the counter key, e.g. bytes read or written """
+        with self.lock:
+            self.bytes[key] += n
+
+    def start(self):
+        if self.cprofile:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if self.tracemalloc:
+            import tracemalloc
+            tracemalloc.start()
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile)
+            logging.info(f"cProfile stats saved to {self.cprofile}")
+            self._profile = None
+        if self.tracemalloc:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                tracemalloc.take_snapshot().dump(self.tracemalloc)
+                tracemalloc.stop()
+                logging.info(f"tracemalloc snapshot saved to {self.tracemalloc}")
+
+    def summary(self):
+        """ lines of the breakdown per stage: calls, total time, p50 and p99 """
+        lines = [f"{'Stage':<12}{'calls':>9}{'total s':>10}"
+                 f"{'p50 ms':>10}{'p99 ms':>10}"]
+        for name, durations in self.durations.items():
+            if not durations:
+                continue
+            d = sorted(durations)
+            lines.append(f"{name:<12}{len(d):>9}{sum(d):>10.3f}"
+                         f"{percentile(d, 0.5) * 1000:>10.3f}"
+                         f"{percentile(d, 0.99) * 1000:>10.3f}")
+        for key, n in sorted(self.bytes.items()):
+            lines.append(f"{key:<12}{n:>9}")
+        return lines
+
+    def report(self):
+        """ logs the breakdown per stage """
+        logging.info("Profile:")
+        for line in self.summary():
+            logging.info(line)
+
+
+class NullProfiler:
+    """ profiler doing nothing, used when profiling is off """
+
+    enabled = False
+    _null = nullcontext()
+
+    def stage(self, name):
+        return self._null
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def count(self, key, n):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def report(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,103 @@
+""" Module records.py - Compact per-file records
+    Keeps what was decided for millions of files in little memory: one __slots__
+    object per file, its folder relative to the infolder and its artist and album
+    shared through a table of strings, its title only when it differs from the one
+    found in its filename.
+    The target is not stored: it is rebuilt from the tags, as decide() builds it.
+"""
+
+import os
+from pathlib import Path
+from sortmp3.fix import Decision
+from sortmp3.formats import handler_for
+from sortmp3.names import sanitize, title_case
+from sortmp3.scan import MUSIC_RE
+
+
+class Strings:
+    """ table of shared strings: each distinct folder, artist or album is stored
+        once """
+
+    def __init__(self):
+        self.table = {}
+
+    def __call__(self, s):
+        return self.table.setdefault(s, s)
+
+    def __len__(self):
+        return len(self.table)
+
+
+class FileRecord:
+    """ a music file and its new tags; title is None when it is the one of the
+        filename """
+
+    __slots__ = ("folder", "name", "artist", "album", "title", "retag")
+
+    def __init__(self, folder, name, artist, album, title, retag):
+        self.folder = folder
+        self.name = name
+        self.artist = artist
+        self.album = album
+        self.title = title
+        self.retag = retag
+
+
+class Catalog:
+    """
+        Records of the files below root, the infolder, in the order they were added.
+        Files outside root keep their absolute folder.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.prefix = os.fspath(self.root) + os.sep
+        self.strings = Strings()
+        self.records = []
+
+    def add(self, decision):
+        """ records the source and new tags of decision """
+        self.append(decision.source, decision.tags_after, decision.retag)
+
+    def append(self, source, tags, retag):
+        folder, name = os.path.split(os.fspath(source))
+        if folder == self.prefix[:-1]:
+            folder = ""
+        elif folder.startswith(self.prefix):
+            folder = folder[len(self.prefix):]
+        title = tags["title"]
+        match = MUSIC_RE.match(name)
+        # titles are mostly unique: not memoized
+        if match and title_case.__wrapped__(match.group(2)) == title:
+            title = None
+        strings = self.strings
+        self.records.append(FileRecord(strings(folder), name, strings(tags["artist"]),
+                                       strings(tags["album"]), title, retag))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def source(self, record):
+        return self.root / record.folder / record.name
+
+    def tags(self, record):
+        """ new tags of the file of record """
+        title = record.title
+        if title is None:
+            title = title_case.__wrapped__(MUSIC_RE.match(record.name).group(2))
+        return {"artist": record.artist, "album": record.album, "title": title}
+
+    def decisions(self, dirs):
+        """ yields the Decision of each record, its target resolved by dirs,
+            a DirPlanner; tags before are not kept """
+        for record in self.records:
+            tags = self.tags(record)
+            target_dir = dirs.target_dir(tags["artist"], tags["album"])
+            ext = handler_for(record.name.rpartition(".")[2].lower()).ext
+            name = tags["artist"] + " - " + tags["title"] + "." + ext
+            target = target_dir / sanitize(name)
+            yield Decision(self.source(record), target_dir, target, None, tags,
+                           record.retag)
@@ -0,0 +1,173 @@
+""" Module scan.py - Streaming discovery of music files
+    Walks the infolder with os.scandir and yields candidate music files lazily
+"""
+
+import fnmatch
+import hashlib
+import os
+import re
+from pathlib import Path
+from sortmp3.formats import HANDLERS
+
+# Strict regex: artist space hyphen space title.extension
+# the extension is that of a registered format, whatever its case: see music_match()
+MUSIC_RE = re.compile(r'^(.+?) - (.+?)\.([^.]+)$')
+
+
+def is_music_name(name):
+    """ cheap test run before the regex: the extension of name is that of
+        a registered format """
+    return name.rpartition(".")[2].lower() in HANDLERS
+
+
+def music_match(name):
+    """ the (artist, title, extension) match of the name of a music file,
+        None for other names """
+    if not is_music_name(name):
+        return None
+    return MUSIC_RE.match(name)
+
+
+def shard_of(path, root, n):
+    """ shard of path, from 0 to n - 1: a stable hash of its path relative to root,
+        the same on every machine whatever the mount point of root """
+    rel = os.path.relpath(path, root).replace(os.sep, "/")
+    digest = hashlib.blake2b(rel.encode("utf-8", "surrogateescape"),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n
+
+
+def _globs(patterns):
+    """ one regex matching any of the glob patterns, None when there are none """
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
+
+class WalkFilter:
+    """
+        What the scanner walks and yields below root.
+        Folders in prune are never descended into, nor folders matching an exclude
+        pattern. Files are yielded when they match no exclude pattern and, when there
+        are include patterns, one of them; then when they are at least min_size bytes
+        and were modified after newer_than, a timestamp. Their size and time are only
+        read when needed.
+        Patterns are globs matched against names, or against paths relative to root
+        when they hold a slash.
+    """
+
+    def __init__(self, root, prune=(), include=(), exclude=(), newer_than=None,
+                 min_size=None):
+        self.prefix = os.path.join(os.fspath(root), "")
+        self.prune = {os.fspath(folder) for folder in prune}
+        self.include_names = _globs([p for p in include if "/" not in p])
+        self.include_paths = _globs([p.strip("/") for p in include if "/" in p])
+        self.exclude_names = _globs([p for p in exclude if "/" not in p])
+        self.exclude_paths = _globs([p.strip("/") for p in exclude if "/" in p])
+        self.newer_than = newer_than
+        self.min_size = min_size
+
+    def _rel(self, path):
+        if not path.startswith(self.prefix):
+            return path
+        return path[len(self.prefix):].replace(os.sep, "/")
+
+    def _matches(self, names, paths, path, name):
+        """ True when name matches the names regex or path, relative to root,
+            the paths regex """
+        return ((names is not None and bool(names.match(name)))
+                or (paths is not None and bool(paths.match(self._rel(path)))))
+
+    def skip_dir(self, path, name):
+        """ True when the folder at path, named name, is not to be walked """
+        if path in self.prune:
+            return True
+        return self._matches(self.exclude_names, self.exclude_paths, path, name)
+
+    def keep_file(self, path, name, stat):
+        """ True when the music file at path, named name, is to be yielded;
+            stat() gives its os.stat_result """
+        if self._matches(self.exclude_names, self.exclude_paths, path, name):
+            return False
+        if self.include_names is not None or self.include_paths is not None:
+            if not self._matches(self.include_names, self.include_paths, path, name):
+                return False
+        if self.newer_than is None and self.min_size is None:
+            return True
+        st = stat()
+        if self.min_size is not None and st.st_size < self.min_size:
+            return False
+        return self.newer_than is None or st.st_mtime > self.newer_than
+
+    def admits(self, path):
+        """ True when the scanner would yield path, a music file found by other
+            means, e.g. watched """
+        path = os.fspath(path)
+        folder = os.path.dirname(path)
+        while folder.startswith(self.prefix):
+            if self.skip_dir(folder, os.path.basename(folder)):
+                return False
+            folder = os.path.dirname(folder)
+        try:
+            return self.keep_file(path, os.path.basename(path), lambda: os.stat(path))
+        except OSError:
+            # left to the caller, which reports why the file cannot be fixed
+            return True
+
+
+def _file_match(entry, skip, walk):
+    """ the match of the file at DirEntry entry when the scanner yields it,
+        None otherwise """
+    name = entry.name
+    try:
+        if not is_music_name(name) or not entry.is_file():
+            return None
+        match = MUSIC_RE.match(name)
+        if not match or entry.path in skip:
+            return None
+        if walk is not None and not walk.keep_file(entry.path, name, entry.stat):
+            return None
+    except OSError:
+        return None
+    return match
+
+
+def scan_music_files(root, skip=(), walk=None):
+    """
+        Yields (Path, match) for every music file found below root.
+
+        DirEntry type info is reused so that no extra stat is needed, the suffix
+        is checked before the regex and candidates are yielded as soon as they are
+        found.
+
+        Each directory is listed in one go before its entries are yielded, so files
+        moved out of it while the caller processes them do not disturb the walk.
+        Paths found in skip (a container of str) are not yielded: this lets an in-place
+        run ignore the files it has just put in the Music Hierarchy.
+        walk, a WalkFilter, prunes folders before they are listed and filters files.
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        subfolders = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if walk is None or not walk.skip_dir(entry.path, entry.name):
+                    subfolders.append(entry.path)
+                continue
+            match = _file_match(entry, skip, walk)
+            if match is not None:
+                yield Path(entry.path), match
+        #
+        # keep a top-down, in-order walk
+        #
+        stack.extend(reversed(subfolders))
@@ -0,0 +1,311 @@
+""" Module tagread.py - Header-only tag readers
+    Decode artist, album and title straight from the ID3v2 frames of an MP3 file,
+    the moov/udta/meta/ilst atoms of an MP4 file or the Vorbis comments of a FLAC or
+    Ogg file, through a memory map, so that only the pages holding the tags are read.
+    Readers return None whenever they cannot handle a file: mutagen is then used
+    instead.
+    Span functions tell where the audio lies, around the tags, for fingerprints.
+"""
+
+import mmap
+import struct
+
+ID3_FRAMES = {b"TPE1": "artist", b"TALB": "album", b"TIT2": "title"}
+
+MP4_ITEMS = {b"\xa9ART": "artist", b"\xa9alb": "album", b"\xa9nam": "title"}
+
+VORBIS_FIELDS = ("artist", "album", "title")
+
+FLAC_VORBIS_COMMENT = 4
+
+# packet types of the comment headers of Vorbis and Opus streams
+OGG_COMMENT_MAGICS = (b"\x03vorbis", b"OpusTags")
+
+ID3_ENCODINGS = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}
+
+# ID3v2.4 frame format flags: grouping, compression, encryption,
+# unsynchronisation, data length indicator
+ID3V24_UNSUPPORTED = 0x004F
+# ID3v2.3 frame format flags: compression, encryption, grouping
+ID3V23_UNSUPPORTED = 0x00E0
+
+
+def read_mapped(path, reader):
+    """ returns {artist, album, title} read by reader from path mapped in memory,
+        None if not possible """
+    try:
+        with open(path, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return reader(m)
+    except (OSError, ValueError, struct.error, UnicodeDecodeError):
+        # empty file, truncated or malformed header...
+        return None
+
+
+def syncsafe(b):
+    return (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+
+
+def _id3_text(data):
+    """ first value of an ID3 text frame, None when its encoding is unknown """
+    encoding = ID3_ENCODINGS.get(data[0])
+    if encoding is None:
+        return None
+    text = data[1:].decode(encoding)
+    return text.split("\x00")[0]
+
+
+def _id3v2_frames(m, tags):
+    """ completes tags with the ID3v2.3/2.4 text frames of m,
+        returns False when the tag is left to mutagen """
+    version, flags = m[3], m[5]
+    # ID3v2.2, unsynchronised tags and extended headers are left to mutagen
+    if version not in (3, 4) or flags & 0xC0:
+        return False
+    unsupported = ID3V24_UNSUPPORTED if version == 4 else ID3V23_UNSUPPORTED
+    end = 10 + syncsafe(m[6:10])
+    pos = 10
+    while pos + 10 <= end and m[pos] != 0:
+        # a null byte starts the padding
+        raw = m[pos + 4:pos + 8]
+        size = syncsafe(raw) if version == 4 else int.from_bytes(raw, "big")
+        key = ID3_FRAMES.get(m[pos:pos + 4])
+        fflags = int.from_bytes(m[pos + 8:pos + 10], "big")
+        pos += 10
+        if pos + size > end:
+            return False
+        if key is not None and key not in tags and size:
+            text = None if fflags & unsupported else _id3_text(m[pos:pos + size])
+            if text is None:
+                return False
+            tags[key] = text
+        pos += size
+    return True
+
+
+def _id3v1(m, tags):
+    """ completes tags with the ID3v1 tag at the end of m, if any,
+        returns False when the tag is left to mutagen """
+    tail = m[-131:]
+    idx = tail.find(b"TAG")
+    if idx < 0:
+        return True
+    # truncated ID3v1 or APEv2 tags are left to mutagen
+    if idx != len(tail) - 128 or b"APETAGEX" in tail:
+        return False
+    v1 = m[-128:]
+    for key, start in (("title", 3), ("artist", 33), ("album", 63)):
+        if key not in tags:
+            value = v1[start:start + 30].split(b"\x00")[0].strip().decode("latin-1")
+            if value:
+                tags[key] = value
+    return True
+
+
+def read_id3(m):
+    """ tags of an MP3 file mapped by m: ID3v2.3/2.4 frames, completed by ID3v1
+        like mutagen does """
+    tags = {}
+    if m[:3] == b"ID3" and not _id3v2_frames(m, tags):
+        return None
+    if not _id3v1(m, tags):
+        return None
+    return {key: tags.get(key, "") for key in ID3_FRAMES.values()}
+
+
+def _atoms(m, start, end):
+    """ yields (name, payload start, atom end) for the atoms found between start
+        and end """
+    pos = start
+    while pos + 8 <= end:
+        size = int.from_bytes(m[pos:pos + 4], "big")
+        name = m[pos + 4:pos + 8]
+        header = 8
+        if size == 1:
+            size = int.from_bytes(m[pos + 8:pos + 16], "big")
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise ValueError("bad atom")
+        yield name, pos + header, pos + size
+        pos += size
+
+
+def _child(m, start, end, name):
+    for n, s, e in _atoms(m, start, end):
+        if n == name:
+            return s, e
+    return None
+
+
+def read_mp4(m):
+    """ tags of an MP4 file mapped by m, from the moov/udta/meta/ilst atoms """
+    moov = _child(m, 0, len(m), b"moov")
+    if moov is None:
+        return None
+    tags = {}
+    udta = _child(m, *moov, b"udta")
+    meta = udta and _child(m, *udta, b"meta")
+    # meta is a full atom: version and flags come first
+    ilst = meta and _child(m, meta[0] + 4, meta[1], b"ilst")
+    if ilst:
+        for name, start, end in _atoms(m, *ilst):
+            key = MP4_ITEMS.get(name)
+            if key is None:
+                continue
+            data = _child(m, start, end, b"data")
+            if data is None:
+                continue
+            # version 0, type 1 is UTF-8 text; then 4 bytes of locale
+            if int.from_bytes(m[data[0]:data[0] + 4], "big") != 1:
+                return None
+            tags[key] = m[data[0] + 8:data[1]].decode("utf-8")
+    return {key: tags.get(key, "") for key in MP4_ITEMS.values()}
+
+
+
+def _vorbis_comment(data, pos):
+    """ tags of the Vorbis comment found at pos in data: vendor string,
+        then KEY=value fields """
+    def field():
+        nonlocal pos
+        n = int.from_bytes(data[pos:pos + 4], "little")
+        if pos + 4 + n > len(data):
+            raise ValueError("truncated comment")
+        pos += 4 + n
+        return data[pos - n:pos]
+    field()
+    if pos + 4 > len(data):
+        raise ValueError("truncated comment")
+    count = int.from_bytes(data[pos:pos + 4], "little")
+    pos += 4
+    tags = {}
+    for i in range(count):
+        key, sep, value = bytes(field()).partition(b"=")
+        # field names are case-insensitive; the first value is the one used,
+        # as with mutagen
+        key = key.decode("ascii").lower()
+        if sep and key in VORBIS_FIELDS and key not in tags:
+            tags[key] = value.decode("utf-8")
+    return {key: tags.get(key, "") for key in VORBIS_FIELDS}
+
+
+def _flac_blocks(m):
+    """ yields (type, payload start, payload end) for the metadata blocks of
+        a FLAC file """
+    if m[:4] != b"fLaC":
+        # ID3 tags before the stream are left to mutagen
+        raise ValueError("not a FLAC stream")
+    pos = 4
+    last = False
+    while not last:
+        if pos + 4 > len(m):
+            raise ValueError("truncated block")
+        last = m[pos] & 0x80
+        size = int.from_bytes(m[pos + 1:pos + 4], "big")
+        yield m[pos] & 0x7F, pos + 4, pos + 4 + size
+        pos += 4 + size
+
+
+def read_flac(m):
+    """ tags of a FLAC file mapped by m, from its VORBIS_COMMENT block """
+    for kind, start, end in _flac_blocks(m):
+        if kind == FLAC_VORBIS_COMMENT:
+            return _vorbis_comment(m[start:end], 0)
+    return dict.fromkeys(VORBIS_FIELDS, "")
+
+
+def _ogg_packets(m):
+    """ yields the packets of the first logical stream of an Ogg file mapped by m """
+    pos = 0
+    serial = None
+    packet = []
+    while pos + 27 <= len(m):
+        if m[pos:pos + 4] != b"OggS":
+            raise ValueError("bad page")
+        page_serial = m[pos + 14:pos + 18]
+        nsegs = m[pos + 26]
+        lacing = m[pos + 27:pos + 27 + nsegs]
+        pos += 27 + nsegs
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            pos += sum(lacing)
+            continue
+        for lace in lacing:
+            packet.append(m[pos:pos + lace])
+            pos += lace
+            # a lacing value below 255 ends a packet
+            if lace < 255:
+                yield b"".join(packet)
+                packet = []
+
+
+def read_ogg(m):
+    """ tags of an Ogg Vorbis or Opus file mapped by m, from its comment header,
+        the second packet """
+    packets = _ogg_packets(m)
+    next(packets, None)
+    comment = next(packets, None)
+    if comment is None:
+        return None
+    for magic in OGG_COMMENT_MAGICS:
+        if comment.startswith(magic):
+            return _vorbis_comment(comment, len(magic))
+    return None
+
+
+def mp3_spans(f, size):
+    """ the audio of an MP3 file: what lies between the ID3v2 header and
+        the ID3v1 tag """
+    head = f.read(10)
+    start = 0
+    if len(head) == 10 and head[:3] == b"ID3":
+        start = 10 + syncsafe(head[6:10])
+        if head[5] & 0x10:
+            # footer
+            start += 10
+    end = size
+    if size - start >= 128:
+        f.seek(size - 128)
+        if f.read(3) == b"TAG":
+            end = size - 128
+    return [(start, end)]
+
+
+def mp4_spans(f, size):
+    """ the audio of an MP4 file: the payload of its mdat atoms """
+    spans = []
+    pos = 0
+    while pos + 8 <= size:
+        f.seek(pos)
+        head = f.read(16)
+        length = int.from_bytes(head[:4], "big")
+        header = 8
+        if length == 1:
+            length = int.from_bytes(head[8:16], "big")
+            header = 16
+        elif length == 0:
+            length = size - pos
+        if length < header:
+            raise ValueError("bad atom")
+        if head[4:8] == b"mdat":
+            spans.append((pos + header, min(pos + length, size)))
+        pos += length
+    return spans
+
+
+def flac_spans(f, size):
+    """ the audio of a FLAC file: the frames following its metadata blocks """
+    pos = 4
+    f.seek(0)
+    if f.read(4) != b"fLaC":
+        return [(0, size)]
+    last = False
+    while not last and pos + 4 <= size:
+        f.seek(pos)
+        head = f.read(4)
+        last = head[0] & 0x80
+        pos += 4 + int.from_bytes(head[1:4], "big")
+    return [(min(pos, size), size)]
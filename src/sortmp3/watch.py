@@ -0,0 +1,224 @@
+""" Module watch.py - Watch mode for FixMusicFile
+    Keeps running and fixes music files as they land in the infolder.
+    Uses inotify on Linux, polling elsewhere or on request.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from sortmp3.scan import scan_music_files, music_match
+
+
+def _scan(root, walk):
+    """ paths of the music files found below root, filtered by walk """
+    return [str(file) for file, match in scan_music_files(root, walk=walk)]
+
+
+class PollSource:
+    """ reports every music file found in root, by a full scan at each call;
+        walk is a WalkFilter """
+
+    def __init__(self, root, walk=None):
+        self.root = root
+        self.walk = walk
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+        return _scan(self.root, self.walk)
+
+    def close(self):
+        pass
+
+
+class InotifySource:
+    """ reports files written or moved into root or any of its subfolders,
+        using Linux inotify; folders pruned or excluded by walk, a WalkFilter,
+        are not watched """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, root, walk=None):
+        self.root = root
+        self.walk = walk
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}
+        self.found = []
+        self.add_tree(root)
+
+    def add_tree(self, folder):
+        """ watches folder and its subfolders; files already there are reported
+            as found """
+        stack = [os.fspath(folder)]
+        while stack:
+            folder = stack.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK)
+            if wd < 0:
+                reason = os.strerror(ctypes.get_errno())
+                logging.warning(f"Cannot watch {folder}: {reason}")
+                continue
+            self.folders[wd] = folder
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.walk is None or not self.walk.skip_dir(entry.path,
+                                                                           entry.name):
+                                stack.append(entry.path)
+                        elif music_match(entry.name):
+                            self.found.append(entry.path)
+            except OSError:
+                continue
+
+    def changes(self, timeout):
+        found, self.found = self.found, []
+        if found:
+            timeout = 0
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return found
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return found
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            self.event(wd, mask, name, found)
+        found.extend(self.found)
+        self.found = []
+        return found
+
+    def event(self, wd, mask, name, found):
+        """ handles an event about name in the folder watched as wd;
+            found gets the files to report """
+        if mask & self.IN_Q_OVERFLOW:
+            logging.warning("inotify queue overflow, rescanning")
+            found.extend(_scan(self.root, self.walk))
+            return
+        if mask & self.IN_IGNORED:
+            self.folders.pop(wd, None)
+            return
+        if wd not in self.folders:
+            return
+        path = os.path.join(self.folders[wd], name)
+        if mask & self.IN_ISDIR:
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO) and (
+                    self.walk is None or not self.walk.skip_dir(path, name)):
+                self.add_tree(path)
+        elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+            found.append(path)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+        Feeds the music files landing in the infolder of fixer to fixer.fix_file,
+        one at a time.
+
+        A file is fixed once its size has been seen unchanged for settle seconds,
+        so that files still being written are left alone.
+        Only the folders that files were moved from are cleaned.
+    """
+
+    def __init__(self, fixer, interval=1.0, settle=2.0, poll=None):
+        self.fixer = fixer
+        self.interval = interval
+        self.settle = settle
+        if poll is None:
+            poll = not sys.platform.startswith("linux")
+        source = PollSource if poll else InotifySource
+        self.source = source(fixer.infolder, walk=fixer.walk)
+        # path -> (size, time of last size change)
+        self.pending = {}
+        # path -> (size, mtime) of files that were fixed but stayed where they were
+        self.done = {}
+        self.fixed = 0
+
+    def step(self):
+        """ waits up to interval for new files, fixes those that are ready
+            returns the number of files fixed """
+        for path in self.source.changes(self.interval):
+            self.pending.setdefault(path, (-1, 0.0))
+        n = 0
+        for path in self.ready(time.monotonic()):
+            if self.fix(path):
+                n += 1
+        self.fixer.settle_moves(wait=True)
+        p = self.fixer.clean_touched()
+        if p:
+            logging.info(f"Folders cleaned: {p}")
+        self.fixed += n
+        return n
+
+    def ready(self, now):
+        """ the pending files whose size has not changed for settle seconds,
+            unless fixed already; files gone are forgotten """
+        ready = []
+        for path, (size, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if st.st_size != size:
+                self.pending[path] = (st.st_size, now)
+                continue
+            if now - since < self.settle:
+                continue
+            del self.pending[path]
+            if self.done.get(path) != (st.st_size, st.st_mtime_ns):
+                ready.append(path)
+        return ready
+
+    def fix(self, path):
+        """ fixes the file at path, returns True when it was processed """
+        file = Path(path)
+        try:
+            final = self.fixer.fix_file(file)
+        except Exception as e:
+            logging.error("Cannot fix %s. Reason: %s", file, e)
+            return False
+        if final is None:
+            return False
+        if final == file:
+            st = os.stat(final)
+            self.done[path] = (st.st_size, st.st_mtime_ns)
+        return True
+
+    def run(self, stop=lambda: False):
+        """ fixes files until stop() is true or Ctrl-C """
+        logging.info(f"Watching {self.fixer.infolder}")
+        self.fixer.begin()
+        try:
+            while not stop():
+                self.step()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.fixer.finish()
+            self.source.close()
+            logging.info(f"Files processed: {self.fixed}")
+        return self.fixed
@@ -0,0 +1,77 @@
+""" test_aio.py - Test for aio.py """
+import asyncio
+import time
+from sortmp3.aio import AsyncFixer
+from sortmp3.fix import FixMusicFile
+from sortmp3.scan import shard_of
+from test_fix import mk_mp3, mk_m4a
+from mutagen import File
+
+
+def test_pipeline(tmp_path):
+    """ all stages, with the scan index opened on the placement thread """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir()
+    titles = ["Penny Lane", "Hello, Goodbye", "Strawberry Fields Forever", "Fool On The Hill"]
+    for t in titles:
+        mk_mp3(albumf / f"The Beatles - {t}.mp3")
+    mk_m4a(inf / "The Beatles - Something.m4a", album="Abbey Road")
+    (inf / "notes.txt").write_text("not music")
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, index=True, streams=2)
+    aio = AsyncFixer(fmf, queue_size=1, read_jobs=3, decide_jobs=2, write_jobs=2)
+    assert asyncio.run(aio.run()) == 5
+    assert aio.failed == 0
+    for t in titles:
+        music = outf / f"Music/The Beatles/Magical Mystery Tour/The Beatles - {t}.mp3"
+        assert music.is_file()
+        assert File(music, easy=True)["album"] == ["Magical Mystery Tour"]
+    assert (outf / "Music/The Beatles/Abbey Road/The Beatles - Something.m4a").is_file()
+    assert not albumf.exists()
+    assert (inf / "notes.txt").exists()
+
+
+def test_dry_run(tmp_path):
+    inf = tmp_path / "in"
+    inf.mkdir()
+    mk_mp3(inf / "The Beatles - Penny Lane.mp3")
+    fmf = FixMusicFile(infolder=inf, outfolder=tmp_path / "out", dry_run=True)
+    assert asyncio.run(AsyncFixer(fmf).run()) == 1
+    assert (inf / "The Beatles - Penny Lane.mp3").is_file()
+    assert not (tmp_path / "out/Music/The Beatles/Single/The Beatles - Penny Lane.mp3").exists()
+
+
+def test_moves_bounded(tmp_path):
+    """ slow moves hold the pipeline back instead of piling up """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    for i in range(12):
+        mk_mp3(inf / f"The Beatles - Song {i}.mp3")
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, streams=4)
+    in_flight = []
+    move, submit = fmf.mover.move, fmf.mover.submit
+    fmf.mover.move = lambda src, dst: time.sleep(0.02) or move(src, dst)
+    fmf.mover.submit = lambda src, dst: in_flight.append(len(fmf._moving)) or submit(src, dst)
+    assert asyncio.run(AsyncFixer(fmf, queue_size=2).run()) == 12
+    assert len(in_flight) == 12 and max(in_flight) <= 2
+    assert len(list((outf / "Music").rglob("*.mp3"))) == 12
+
+
+def test_shards(tmp_path):
+    """ only the files of the shard of the fixer are processed """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    files = [inf / f"The Beatles - Song {i}.mp3" for i in range(8)]
+    for f in files:
+        mk_mp3(f)
+    counts = []
+    for i in (1, 2, 3, 4):
+        fmf = FixMusicFile(infolder=inf, outfolder=tmp_path / "out", shard=(i, 4))
+        counts.append(asyncio.run(AsyncFixer(fmf).run()))
+        assert counts[-1] == sum(shard_of(f, inf, 4) == i - 1 for f in files)
+    assert sum(counts) == 8 and max(counts) < 8
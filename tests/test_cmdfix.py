@@ -1,9 +1,14 @@
 """ test_cmdfix.py - Test for cmdfix.py """
 import argparse
 from sortmp3.cmdfix import CmdFix
+import os
+import subprocess
 import sys
 import pytest
 
+# microseconds, cumulative import time of sortmp3.cmdfix
+IMPORT_BUDGET = 100_000
+
 
 def test_invalid_priority(monkeypatch):
     test_args = ["prog", "--album", "Tag", "--artist", "Foo"]
@@ -37,5 +42,115 @@ def test_default(monkeypatch):
     assert cf.album == "Tag"
     assert cf.title == "Tag"
     assert cf.log_level == "INFO"
+    assert cf.log_queue == False
     assert cf.dry_run == False
     assert cf.overwrite == False
+    assert cf.jobs == 1
+    assert cf.executor == "thread"
+    assert cf.index == False
+    assert cf.mode == "fix"
+    assert cf.plan is None
+    assert cf.streams == 1
+    assert cf.verify == False
+    assert cf.dest_index == False
+    assert cf.dest_snapshot is None
+    assert cf.dedupe == False
+    assert cf.apply is None
+    assert cf.resume == False
+    assert cf.undo == False
+    assert cf.journal == False
+    assert cf.shard is None
+    assert cf.include == cf.exclude == []
+    assert cf.newer_than is None
+    assert cf.min_size is None
+    assert cf.profile == False
+    assert cf.cprofile is None
+    assert cf.tracemalloc is None
+
+
+def test_shard(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["prog", "--shard", "2/3"])
+    cf = CmdFix(argparse.ArgumentParser())
+    cf.parse()
+    assert cf.shard == (2, 3)
+    for arg in ["0/3", "4/3", "x"]:
+        monkeypatch.setattr(sys, "argv", ["prog", "--shard", arg])
+        with pytest.raises(SystemExit):
+            CmdFix(argparse.ArgumentParser()).parse()
+
+
+def test_filters(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["prog", "--exclude", "Trash", "--exclude", "*.tmp.mp3",
+                                      "--include", "Incoming/*", "--newer-than", "2024-01-31T12:00+00:00",
+                                      "--min-size", "1.5K"])
+    cf = CmdFix(argparse.ArgumentParser())
+    cf.parse()
+    assert cf.exclude == ["Trash", "*.tmp.mp3"]
+    assert cf.include == ["Incoming/*"]
+    assert cf.newer_than == 1706702400
+    assert cf.min_size == 1536
+    for args in (["--newer-than", "yesterday"], ["--min-size", "big"], ["--min-size", "-1"]):
+        monkeypatch.setattr(sys, "argv", ["prog"] + args)
+        with pytest.raises(SystemExit):
+            CmdFix(argparse.ArgumentParser()).parse()
+
+
+def test_watch_mode(monkeypatch):
+    test_args = ["prog", "watch", "-i", "in", "--settle", "5", "--poll"]
+    monkeypatch.setattr(sys, "argv", test_args)
+    cf = CmdFix(argparse.ArgumentParser())
+    cf.parse()
+    assert cf.mode == "watch"
+    assert cf.infolder == "in"
+    assert cf.settle == 5.0
+    assert cf.poll
+
+
+def test_jobs(monkeypatch):
+    test_args = ["prog", "--jobs", "8"]
+    monkeypatch.setattr(sys, "argv", test_args)
+    cf = CmdFix(argparse.ArgumentParser())
+    cf.parse()
+    assert cf.jobs == 8
+
+
+def test_invalid_executor(monkeypatch):
+    test_args = ["prog", "--executor", "fiber"]
+    monkeypatch.setattr(sys, "argv", test_args)
+    cf = CmdFix(argparse.ArgumentParser())
+    with pytest.raises(SystemExit) as e:
+        cf.parse()
+    assert e.value.code != 0
+
+
+def test_plan_or_apply(monkeypatch):
+    test_args = ["prog", "--plan", "p.ndjson", "--apply", "p.ndjson"]
+    monkeypatch.setattr(sys, "argv", test_args)
+    cf = CmdFix(argparse.ArgumentParser())
+    with pytest.raises(SystemExit) as e:
+        cf.parse()
+    assert e.value.code != 0
+
+
+def import_times(module):
+    """ cumulative import time in microseconds of each module loaded by importing module """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         capture_output=True, text=True, env=env, check=True)
+    times = {}
+    for line in out.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def test_import_time():
+    """ --help and usage errors load neither FixMusicFile nor mutagen """
+    times = import_times("sortmp3.cmdfix")
+    assert "sortmp3.fix" not in times
+    assert not [m for m in times if m.startswith(("mutagen", "multiprocessing"))]
+    assert times["sortmp3.cmdfix"] < IMPORT_BUDGET
+    # mutagen is loaded when a file is handled
+    times = import_times("sortmp3.fix")
+    assert not [m for m in times if m.startswith("mutagen")]
@@ -0,0 +1,55 @@
+""" test_dest.py - Test for dest.py """
+from sortmp3.dest import DestIndex
+from sortmp3.fix import FixMusicFile
+import logging
+import shutil
+
+
+def test_build_save_load(tmp_path):
+    music = tmp_path / "Music"
+    (music / "The Beatles" / "Single").mkdir(parents=True)
+    f = music / "The Beatles" / "Single" / "The Beatles - Penny Lane.mp3"
+    f.write_bytes(b"")
+    dest = DestIndex(music).build()
+    assert f in dest
+    assert music / "The Beatles" in dest.folders
+    dest.moved(f, music / "The Beatles" / "Single" / "The Beatles - Hello, Goodbye.mp3")
+    assert f not in dest
+    dest.moved(tmp_path / "elsewhere.mp3", f)
+    assert f in dest and len(dest) == 2
+    snapshot = tmp_path / "snapshot.txt"
+    dest.save(snapshot)
+    assert DestIndex(music).load(snapshot).files == dest.files
+
+
+def test_duplicates_in_dry_run(tmp_path, caplog):
+    """ duplicates within a batch are caught without any file being moved """
+    inf = tmp_path / "in"
+    outf = tmp_path / "out"
+    outf.mkdir()
+    for sub in ("Subfolder1", "Subfolder2"):
+        albumf = inf / sub / "Magical Mystery Tour"
+        albumf.mkdir(parents=True)
+        shutil.copy("tests/sample.mp3", albumf / "The Beatles - Penny Lane.mp3")
+    caplog.set_level(logging.INFO)
+    assert FixMusicFile(infolder=inf, outfolder=outf, dry_run=True, dest_index=True).run() == 2
+    assert "Duplicate ignored: The Beatles - Penny Lane.mp3" in caplog.text
+    assert not (outf / "Music/The Beatles/Magical Mystery Tour/The Beatles - Penny Lane.mp3").exists()
+
+
+def test_snapshot(tmp_path):
+    """ the snapshot is saved after a real run and used by the next one """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    snapshot = tmp_path / "snapshot.txt"
+    shutil.copy("tests/sample.mp3", inf / "The Beatles - Penny Lane.mp3")
+    FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, dest_snapshot=snapshot).run()
+    assert snapshot.read_text().splitlines() == ["The Beatles/Single/The Beatles - Penny Lane.mp3"]
+    #
+    # the same file again is a duplicate, known from the snapshot
+    #
+    shutil.copy("tests/sample.mp3", inf / "The Beatles - Penny Lane.mp3")
+    FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, dest_snapshot=snapshot).run()
+    assert (inf / "The Beatles - Penny Lane.mp3").is_file()
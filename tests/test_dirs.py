@@ -0,0 +1,23 @@
+""" test_dirs.py - Test for dirs.py """
+from sortmp3.dirs import DirPlanner
+from sortmp3.fix import sanitize
+
+
+def test_planner(tmp_path):
+    """ each target folder is created once, sanitized names are memoized """
+    cleaned = []
+
+    def clean(name):
+        cleaned.append(name)
+        return sanitize(name)
+    dirs = DirPlanner(tmp_path / "Music", clean)
+    for title in range(12):
+        folder = dirs.target_dir("AC:DC", "Back  In Black")
+        dirs.ensure(folder)
+    assert folder == tmp_path / "Music" / "AC DC" / "Back In Black"
+    assert folder.is_dir()
+    assert cleaned == ["AC:DC", "Back  In Black"]
+    assert (dirs.mkdirs, dirs.avoided) == (1, 11)
+    dirs.reset()
+    dirs.ensure(folder)
+    assert dirs.mkdirs == 2
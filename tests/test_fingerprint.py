@@ -0,0 +1,126 @@
+""" test_fingerprint.py - Test for fingerprint.py """
+from sortmp3.fingerprint import fingerprint, FingerprintCache
+from sortmp3.fix import FixMusicFile
+from mutagen.id3 import TIT2, TPE1
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4
+import json
+import os
+import shutil
+from pathlib import Path
+
+
+def mk_mp3(filepath, artist="", title="", extra=b""):
+    """ sample.mp3, optionally with more audio, tagged """
+    shutil.copy("tests/sample.mp3", filepath)
+    with open(filepath, "ab") as f:
+        f.write(extra)
+    audio = MP3(filepath)
+    audio["TIT2"] = TIT2(encoding=3, text=title)
+    audio["TPE1"] = TPE1(encoding=3, text=artist)
+    audio.save()
+
+
+def test_tags_ignored(tmp_path):
+    """ same audio, different tags: same fingerprint """
+    a, b, c = tmp_path / "a.mp3", tmp_path / "b.mp3", tmp_path / "c.mp3"
+    mk_mp3(a, "The Beatles", "Penny Lane")
+    mk_mp3(b, "Beatles", "Penny Lane (Remastered 2009)")
+    mk_mp3(c, "The Beatles", "Penny Lane", extra=b"\xff\xfb\x90\x64" + b"\x55" * 413)
+    assert a.stat().st_size != b.stat().st_size
+    assert fingerprint(a, "mp3") == fingerprint(b, "mp3")
+    assert fingerprint(a, "mp3") != fingerprint(c, "mp3")
+
+
+def test_mp4_tags_ignored(tmp_path):
+    a, b = tmp_path / "a.m4a", tmp_path / "b.m4a"
+    shutil.copy("tests/sample.m4a", a)
+    shutil.copy("tests/sample.m4a", b)
+    audio = MP4(b)
+    audio["\xa9nam"] = ["Penny Lane"]
+    audio.save()
+    assert fingerprint(a, "m4a") == fingerprint(b, "m4a")
+
+
+def test_cache(tmp_path):
+    a = tmp_path / "a.mp3"
+    mk_mp3(a, "The Beatles", "Penny Lane")
+    cache = FingerprintCache.under(tmp_path)
+    assert cache.lookup(a, os.stat(a)) is None
+    cache.record(a, "1234")
+    assert cache.lookup(a, os.stat(a)) == "1234"
+    cache.close()
+
+
+def test_dedupe(tmp_path):
+    """ the same recording under other tags is skipped, another recording with the same name is kept """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    mk_mp3(inf / "The Beatles - Penny Lane.mp3")
+    FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, dedupe=True).run()
+    stored = outf / "Music/The Beatles/Single/The Beatles - Penny Lane.mp3"
+    assert stored.is_file()
+    #
+    # same audio, other name; other audio, same name
+    #
+    mk_mp3(inf / "Beatles - Penny Lane Remastered.mp3")
+    mk_mp3(inf / "The Beatles - Penny Lane.mp3", extra=b"\xff\xfb\x90\x64" + b"\x55" * 413)
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, dedupe=True, jobs=2)
+    assert fmf.run() == 2
+    assert (inf / "Beatles - Penny Lane Remastered.mp3").is_file()
+    assert not (outf / "Music/Beatles").exists()
+    assert (outf / "Music/The Beatles/Single/The Beatles - Penny Lane (2).mp3").is_file()
+    assert not (inf / "The Beatles - Penny Lane.mp3").exists()
+
+
+def test_dedupe_plan_apply(tmp_path):
+    """ distinct recordings of a plan are all moved, a planned duplicate is left in place """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    for i, title in enumerate(["Penny Lane", "Hello, Goodbye", "Blue Jay Way"]):
+        mk_mp3(inf / f"The Beatles - {title}.mp3", extra=b"\xff\xfb\x90\x64" + bytes([i]) * 413)
+    mk_mp3(inf / "Beatles - Penny Lane Remastered.mp3", extra=b"\xff\xfb\x90\x64" + bytes([0]) * 413)
+    planf = tmp_path / "plan.ndjson"
+    with open(planf, "w") as out:
+        assert FixMusicFile(infolder=inf, outfolder=outf, dedupe=True).plan(out) == 4
+    entries = {e["source"]: e for e in map(json.loads, planf.read_text().splitlines())}
+    assert sorted(e["action"] for e in entries.values()) == ["duplicate", "move", "move", "move"]
+    assert all(e["digest"] for e in entries.values())
+    duplicate, = [Path(e["source"]) for e in entries.values() if e["action"] == "duplicate"]
+    # plans written before digests were recorded
+    plan = [json.dumps({k: v for k, v in e.items() if k != "digest"}) for e in entries.values()]
+    assert FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, dedupe=True).apply(plan) == 4
+    assert len(list((outf / "Music").rglob("*.mp3"))) == 3
+    assert list(inf.iterdir()) == [duplicate]
+
+
+def test_dedupe_plan_name_taken(tmp_path):
+    """ other recordings of a taken name are planned where run() puts them """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    for i, name in enumerate(["The Beatles - Penny Lane", "the beatles - penny lane"], 1):
+        mk_mp3(inf / f"{name}.mp3", extra=b"\xff\xfb\x90\x64" + bytes([i]) * 413)
+    result = next(FixMusicFile(infolder=inf, outfolder=outf).process([inf / "The Beatles - Penny Lane.mp3"]))
+    taken = result.target
+    taken.parent.mkdir(parents=True, exist_ok=True)
+    mk_mp3(taken, extra=b"\xff\xfb\x90\x64" + bytes([0]) * 413)
+    fixer = FixMusicFile(infolder=inf, outfolder=outf, dedupe=True)
+    assert [r.action for r in fixer.process(sorted(inf.iterdir()))] == ["move", "move"]
+    planf = tmp_path / "plan.ndjson"
+    with open(planf, "w") as out:
+        assert FixMusicFile(infolder=inf, outfolder=outf, dedupe=True).plan(out) == 2
+    entries = [json.loads(line) for line in planf.read_text().splitlines()]
+    assert [e["action"] for e in entries] == ["move", "move"]
+    assert sorted(Path(e["target"]).name for e in entries) == [
+        "The Beatles - Penny Lane (2).mp3", "The Beatles - Penny Lane (3).mp3"]
+    with open(planf) as plan:
+        assert FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, dedupe=True).apply(plan) == 2
+    assert sorted(f.name for f in taken.parent.iterdir()) == [
+        "The Beatles - Penny Lane (2).mp3", "The Beatles - Penny Lane (3).mp3", taken.name]
+    assert list(inf.iterdir()) == []
@@ -1,6 +1,7 @@
 """ test_fix.py - Test for fix.py """
 import argparse
-from sortmp3.fix import FixMusicFile, dir_empty, clean_dirs
+from sortmp3.fix import FixMusicFile, Result, dir_empty, clean_dirs, clean_parents
+from sortmp3.profiling import Profiler
 import sys
 import pytest
 from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON
@@ -9,6 +10,7 @@ from mutagen.mp4 import MP4
 from mutagen import File
 from pathlib import Path
 import shutil
+import json
 
 
 def test_dir_empty(tmp_path):
@@ -39,6 +41,18 @@ def test_clean_dirs(tmp_path):
     assert p==3
 
 
+def test_clean_parents(tmp_path):
+    """ only the given folders and their empty ancestors are removed """
+    a = tmp_path / "a" / "b" / "c"
+    a.mkdir(parents=True)
+    other = tmp_path / "a" / "other"
+    other.mkdir()
+    untouched = tmp_path / "untouched"
+    untouched.mkdir()
+    assert clean_parents([a], tmp_path) == 2
+    assert not (tmp_path / "a" / "b").exists()
+    assert other.exists() and untouched.exists()
+
 
 def mk_m4a(filepath, artist="", album="", title="", genre=""):
     """Make an M4A file with no audio """
@@ -421,7 +435,8 @@ def test_update_music_hierarchy(tmp_path):
     # attempt to restructure Music Hierarchy in place
     # 
     outf = inf
-    fmf=FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, overwrite=True)
+    # the Music Hierarchy is only walked when it is the infolder itself
+    fmf=FixMusicFile(infolder=inf / "Music", outfolder=outf, dry_run=False, overwrite=True)
     r = fmf.run()
     #
     #
@@ -620,7 +635,8 @@ def test_inplace(tmp_path):
     # attempt to restructure Music Hierarchy in place
     # 
     outf = inf
-    fmf=FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, overwrite=True)
+    # the Music Hierarchy is only walked when it is the infolder itself
+    fmf=FixMusicFile(infolder=inf / "Music", outfolder=outf, dry_run=False, overwrite=True)
     r = fmf.run()
     #
     #
@@ -663,3 +679,278 @@ def test_inplace(tmp_path):
     assert not fi1.exists()
     assert not fi2.exists()
     assert not fi3.exists()
+
+
+def test_album_jobs(tmp_path):
+    """ Test the Fix class with an album processed by a pool of threads """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir()
+    titles = ["Penny Lane", "Hello, Goodbye", "Strawberry Fields Forever", "Fool On The Hill"]
+    for t in titles:
+        mk_mp3(albumf / f"The Beatles - {t}.mp3")
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, jobs=3)
+    r = fmf.run()
+    assert r == 4
+    for t in titles:
+        fo = outf / f"Music/The Beatles/Magical Mystery Tour/The Beatles - {t}.mp3"
+        assert fo.is_file()
+        audiofile = File(fo, easy=True)
+        assert audiofile.get("title", [""])[0] == t
+        assert audiofile.get("album", [""])[0] == "Magical Mystery Tour"
+    assert dir_empty(inf)
+
+
+def test_album_process_pool(tmp_path):
+    """ Test the Fix class with an album processed by a pool of processes, in small chunks """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir()
+    titles = ["Penny Lane", "Hello, Goodbye", "Strawberry Fields Forever"]
+    for t in titles:
+        mk_mp3(albumf / f"The Beatles - {t}.mp3")
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, jobs=2,
+                       executor="process", chunk_size=2)
+    r = fmf.run()
+    assert r == 3
+    for t in titles:
+        fo = outf / f"Music/The Beatles/Magical Mystery Tour/The Beatles - {t}.mp3"
+        assert fo.is_file()
+        audiofile = File(fo, easy=True)
+        assert audiofile.get("title", [""])[0] == t
+    assert dir_empty(inf)
+
+
+def test_plan_apply(tmp_path, monkeypatch):
+    """ a plan is written without changing anything, then applied without parsing files again """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir()
+    mk_mp3(albumf / "The Beatles - Penny Lane.mp3")
+    mk_mp3(albumf / "The Beatles - Hello, Goodbye.mp3")
+    planf = tmp_path / "plan.ndjson"
+    with open(planf, "w") as out:
+        assert FixMusicFile(infolder=inf, outfolder=outf).plan(out) == 2
+    assert (albumf / "The Beatles - Penny Lane.mp3").is_file()
+    entries = [json.loads(line) for line in planf.read_text().splitlines()]
+    assert {e["action"] for e in entries} == {"move"}
+    assert entries[0]["tags_after"]["album"] == "Magical Mystery Tour"
+    #
+    # a file modified after planning is skipped
+    #
+    with open(albumf / "The Beatles - Hello, Goodbye.mp3", "ab") as f:
+        f.write(b"\0")
+    parsed = []
+    load = FixMusicFile.load
+    monkeypatch.setattr(FixMusicFile, "load", lambda self, file, filtyp: parsed.append(file) or load(self, file, filtyp))
+    with open(planf) as plan:
+        assert FixMusicFile(infolder=inf, outfolder=outf, dry_run=False).apply(plan) == 1
+    fo = outf / "Music/The Beatles/Magical Mystery Tour/The Beatles - Penny Lane.mp3"
+    assert fo.is_file()
+    assert File(fo, easy=True).get("album", [""])[0] == "Magical Mystery Tour"
+    assert (albumf / "The Beatles - Hello, Goodbye.mp3").is_file()
+    # only opened to write its tags
+    assert len(parsed) == 1
+
+
+def test_album_streams(tmp_path):
+    """ Test the Fix class with concurrent move streams """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir()
+    titles = ["Penny Lane", "Hello, Goodbye", "Strawberry Fields Forever"]
+    for t in titles:
+        mk_mp3(albumf / f"The Beatles - {t}.mp3")
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, streams=2, verify=True)
+    assert fmf.run() == 3
+    for t in titles:
+        assert (outf / f"Music/The Beatles/Magical Mystery Tour/The Beatles - {t}.mp3").is_file()
+    assert fmf.mover.renamed == 3
+    assert dir_empty(inf)
+
+
+def test_clean_touched_only(tmp_path):
+    """ only the folders files were moved from are cleaned """
+    inf = tmp_path / "in"
+    albumf = inf / "Abbey Road"
+    albumf.mkdir(parents=True)
+    untouched = inf / "Empty" / "Folder"
+    untouched.mkdir(parents=True)
+    outf = tmp_path / "out"
+    outf.mkdir()
+    mk_mp3(albumf / "The Beatles - Come Together.mp3")
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False)
+    assert fmf.run() == 1
+    assert not albumf.exists()
+    assert untouched.exists()
+    assert inf.exists()
+
+
+def test_profile(tmp_path):
+    """ Test the Fix class with stage timers """
+    inf = tmp_path / "in"
+    albumf = inf / "Abbey Road"
+    albumf.mkdir(parents=True)
+    outf = tmp_path / "out"
+    outf.mkdir()
+    for t in ["Come Together", "Something"]:
+        mk_mp3(albumf / f"The Beatles - {t}.mp3")
+    profiler = Profiler()
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, profiler=profiler)
+    assert fmf.run() == 2
+    calls = {stage: len(d) for stage, d in profiler.durations.items()}
+    assert calls["read"] == calls["merge"] == calls["save"] == calls["move"] == 2
+    assert calls["scan"] == 3
+    assert calls["clean"] == 1
+    assert profiler.bytes["bytes written"] > 0
+
+
+def test_shards(tmp_path):
+    """ shards process distinct files, a target taken by another shard is left alone """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir()
+    titles = [f"Song {i}" for i in range(12)]
+    for t in titles:
+        mk_mp3(albumf / f"The Beatles - {t}.mp3")
+    n = 0
+    for i in (1, 2, 3):
+        fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, shard=(i, 3))
+        assert fmf.mover.exclusive
+        n += fmf.run()
+    assert n == 12
+    for t in titles:
+        assert (outf / f"Music/The Beatles/Magical Mystery Tour/The Beatles - {t}.mp3").is_file()
+    #
+    # another shard took the target between the check and the move
+    #
+    albumf.mkdir()
+    mk_mp3(albumf / "The Beatles - Song 0.mp3")
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, shard=(1, 1))
+    fmf.exists = lambda target: False
+    assert fmf.run() == 1
+    assert (albumf / "The Beatles - Song 0.mp3").is_file()
+    with pytest.raises(ValueError):
+        FixMusicFile(infolder=inf, outfolder=outf, shard=(0, 3))
+
+
+def test_prune_music(tmp_path):
+    """ an in-place run does not walk down the Music Hierarchy, nor excluded folders """
+    inf = tmp_path / "lib"
+    (inf / "Music/The Beatles/Magical Mystery Tour").mkdir(parents=True)
+    (inf / "Incoming").mkdir()
+    (inf / "Trash").mkdir()
+    sorted_ = inf / "Music/The Beatles/Magical Mystery Tour/beatles - penny lane.mp3"
+    mk_mp3(sorted_)
+    mk_mp3(inf / "Incoming/The Beatles - Hello, Goodbye.mp3")
+    mk_mp3(inf / "Trash/The Beatles - Fool On The Hill.mp3")
+    fmf = FixMusicFile(infolder=inf, outfolder=inf, dry_run=False, exclude=["Trash"])
+    assert fmf.walk.prune == {str(inf / "Music")}
+    assert fmf.run() == 1
+    assert (inf / "Music/The Beatles/Incoming/The Beatles - Hello, Goodbye.mp3").is_file()
+    assert sorted_.is_file()
+    assert (inf / "Trash/The Beatles - Fool On The Hill.mp3").is_file()
+    assert [r.action for r in fmf.process([sorted_])] == ["skip"]
+    # the Music Hierarchy is walked when it is the infolder
+    assert not FixMusicFile(infolder=inf / "Music", outfolder=inf).walk.prune
+
+
+def test_process(tmp_path):
+    """ one Result per path, in order """
+    inf = tmp_path / "in"
+    albumf = inf / "Abbey Road"
+    albumf.mkdir(parents=True)
+    outf = tmp_path / "out"
+    outf.mkdir()
+    titles = ["Come Together", "Something", "Because"]
+    for t in titles:
+        mk_mp3(albumf / f"The Beatles - {t}.mp3")
+    music = outf / "Music/The Beatles/Abbey Road"
+    music.mkdir(parents=True)
+    shutil.copy(albumf / "The Beatles - Because.mp3", music)
+    (albumf / "cover.jpg").write_bytes(b"")
+    paths = [albumf / f"The Beatles - {t}.mp3" for t in titles]
+    paths += [albumf / "cover.jpg", albumf / "The Beatles - Missing.mp3"]
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, streams=2)
+    results = list(fmf.process(str(p) for p in paths))
+    assert [r.source for r in results] == paths
+    assert [r.action for r in results] == ["move", "move", "duplicate", "skip", "error"]
+    assert results[0] == Result(paths[0], "move", music / "The Beatles - Come Together.mp3",
+                                music / "The Beatles - Come Together.mp3",
+                                {"artist": "", "album": "", "title": ""},
+                                {"artist": "The Beatles", "album": "Abbey Road", "title": "Come Together"},
+                                None, results[0].timings)
+    assert set(results[0].timings) == {"decide", "place"}
+    assert results[1].final.is_file()
+    assert results[2].final == paths[2] and paths[2].is_file()
+    assert results[4].error
+
+
+
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_process_actions(tmp_path, dry_run):
+    """ the action of a Result is the one taken, or that would be taken in a dry run """
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    # a target taken in the Music Hierarchy
+    mk_mp3(inf / "The Beatles - Taken.mp3")
+    (outf / "Music/The Beatles/Single").mkdir(parents=True)
+    shutil.copy(inf / "The Beatles - Taken.mp3", outf / "Music/The Beatles/Single")
+    paths = [inf / "The Beatles - Penny Lane.mp3", inf / "The Beatles - Taken.mp3"]
+    mk_mp3(paths[0])
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=dry_run, dest_index=True)
+    results = list(fmf.process(paths))
+    assert [(r.action, r.error) for r in results] == [("move", None), ("duplicate", None)]
+    assert [r.final == r.source for r in results] == [dry_run, True]
+    #
+    # the same audio under two names, no recording in the Music Hierarchy yet
+    #
+    shutil.rmtree(outf / "Music")
+    paths = [inf / "The Beatles - Hello, Goodbye.mp3", inf / "Beatles - Hello Goodbye Remastered.mp3"]
+    for p in paths:
+        mk_mp3(p)
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=dry_run, dedupe=True)
+    results = list(fmf.process(paths))
+    assert [(r.action, r.error) for r in results] == [("move", None), ("duplicate", None)]
+    assert [r.final == r.source for r in results] == [dry_run, True]
+
+def test_m4a(tmp_path, monkeypatch):
+    """ an M4A file keeps its own tags: saved once, without an injected ID3 header """
+    from mutagen.easymp4 import EasyMP4
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir()
+    mk_m4a(albumf / "The Beatles - Penny Lane.m4a", title="Penny Lane")
+    saves = []
+    save = EasyMP4.save
+    monkeypatch.setattr(EasyMP4, "save", lambda self, *args, **kwargs: saves.append(self) or save(self, *args, **kwargs))
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False)
+    assert fmf.run() == 1
+    assert len(saves) == 1
+    fo = outf / "Music/The Beatles/Magical Mystery Tour/The Beatles - Penny Lane.m4a"
+    assert fo.read_bytes()[:3] != b"ID3"
+    audiofile = File(fo, easy=True)
+    assert isinstance(audiofile, MP4)
+    assert audiofile.get("artist", [""])[0] == "The Beatles"
+    assert audiofile.get("title", [""])[0] == "Penny Lane"
+    assert audiofile.get("album", [""])[0] == "Magical Mystery Tour"
@@ -0,0 +1,113 @@
+""" test_formats.py - Test for formats.py """
+from sortmp3.formats import HANDLERS, Handler, read_tags, open_tags, handler_for
+from sortmp3.fingerprint import fingerprint
+from sortmp3.fix import FixMusicFile
+from sortmp3.scan import scan_music_files
+from mutagen.ogg import OggPage
+from mutagen import File
+import struct
+import pytest
+
+
+def mk_flac(path):
+    """ a FLAC stream without Vorbis comments: STREAMINFO then a frame """
+    info = struct.pack(">HH", 4096, 4096) + bytes(6)
+    # 44100 Hz, 2 channels, 16 bits per sample
+    info += ((44100 << 44) | (1 << 41) | (15 << 36)).to_bytes(8, "big") + bytes(16)
+    path.write_bytes(b"fLaC" + bytes([0x80]) + len(info).to_bytes(3, "big") + info + b"\xff\xf8" + bytes(64))
+
+
+def mk_ogg(path, packets):
+    """ an Ogg stream of one page per packet """
+    pages = []
+    for seq, packet in enumerate(packets):
+        page = OggPage()
+        page.serial = 1
+        page.sequence = seq
+        page.first = seq == 0
+        page.last = seq == len(packets) - 1
+        page.position = 960 if page.last else 0
+        page.packets = [packet]
+        pages.append(page.write())
+    path.write_bytes(b"".join(pages))
+
+
+def comment(magic):
+    """ an empty Vorbis comment header """
+    return magic + struct.pack("<I", 4) + b"test" + struct.pack("<I", 0)
+
+
+def mk_opus(path):
+    mk_ogg(path, [b"OpusHead" + bytes([1, 2]) + struct.pack("<HIhB", 312, 48000, 0, 0),
+                  comment(b"OpusTags"), bytes(40)])
+
+
+def mk_vorbis(path):
+    mk_ogg(path, [b"\x01vorbis" + struct.pack("<IBIiiiBB", 0, 2, 44100, 0, 128000, 0, 0xb8, 1),
+                  comment(b"\x03vorbis") + b"\x01", b"\x05vorbis" + bytes(20), bytes(40)])
+
+
+MAKERS = {"flac": mk_flac, "ogg": mk_vorbis, "opus": mk_opus}
+
+
+def easy_tags(path):
+    audiofile = File(path)
+    return {it: audiofile.get(it, [""])[0] for it in ("artist", "album", "title")}
+
+
+@pytest.mark.parametrize("filtyp", sorted(MAKERS))
+def test_read_vorbis_comments(tmp_path, filtyp):
+    """ the fast readers find the tags written by mutagen """
+    f = tmp_path / f"a.{filtyp}"
+    MAKERS[filtyp](f)
+    assert read_tags(f, filtyp) == {"artist": "", "album": "", "title": ""}
+    audiofile = open_tags(f, filtyp)
+    audiofile["ARTIST"] = "Björk"
+    audiofile["title"] = ["Jóga", "Joga"]
+    audiofile.save()
+    assert read_tags(f, filtyp) == easy_tags(f) == {"artist": "Björk", "album": "", "title": "Jóga"}
+
+
+def test_dispatch_by_extension(tmp_path):
+    """ the extension alone decides the handler, the content is not sniffed """
+    f = tmp_path / "a.flac"
+    mk_vorbis(f)
+    assert read_tags(f, "flac") is None
+    assert read_tags(f, "ogg") is not None
+    assert read_tags(f, "wav") is None
+    with pytest.raises(ValueError):
+        handler_for("wav")
+
+
+def test_register(tmp_path, monkeypatch):
+    """ files of a registered format are found by the scanner, whatever the case of their extension """
+    (tmp_path / "Björk - Jóga.WV").write_bytes(b"")
+    (tmp_path / "Björk - Hunter.flac").write_bytes(b"")
+    assert [f.name for f, m in scan_music_files(tmp_path)] == ["Björk - Hunter.flac"]
+    monkeypatch.setitem(HANDLERS, "wv", Handler(None, open_tags, "wv"))
+    assert sorted(f.name for f, m in scan_music_files(tmp_path)) == ["Björk - Hunter.flac", "Björk - Jóga.WV"]
+
+
+def test_flac_fingerprint(tmp_path):
+    """ tags are left out of the fingerprint of a FLAC file """
+    f = tmp_path / "a.flac"
+    mk_flac(f)
+    before = fingerprint(f, "flac")
+    audiofile = open_tags(f, "flac")
+    audiofile["artist"] = "Björk"
+    audiofile.save()
+    assert fingerprint(f, "flac") == before != fingerprint(f, "wav")
+
+
+@pytest.mark.parametrize("filtyp", sorted(MAKERS))
+def test_fix(tmp_path, filtyp):
+    """ FLAC and Ogg files are tagged and put in the Music Hierarchy under a lowercase extension """
+    inf = tmp_path / "in"
+    albumf = inf / "Homogenic"
+    albumf.mkdir(parents=True)
+    outf = tmp_path / "out"
+    outf.mkdir()
+    MAKERS[filtyp](albumf / f"björk - jóga.{filtyp.upper()}")
+    assert FixMusicFile(infolder=inf, outfolder=outf, dry_run=False).run() == 1
+    fo = outf / f"Music/Björk/Homogenic/Björk - Jóga.{filtyp}"
+    assert easy_tags(fo) == {"artist": "Björk", "album": "Homogenic", "title": "Jóga"}
@@ -0,0 +1,23 @@
+""" test_fullog.py - Test for fullog.py """
+import logging
+from sortmp3.fullog import Full_Log
+
+
+def test_queue(tmp_path, monkeypatch):
+    """ records are written to the log file by the listener thread, formatted once """
+    monkeypatch.chdir(tmp_path)
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    try:
+        log = Full_Log("queued", level="INFO", use_queue=True)
+        logging.info("Moving to %s", "The Beatles - Something.mp3")
+        logging.debug("not shown")
+        log.stop()
+        lines = (tmp_path / "queued.log").read_text(encoding="utf-8").splitlines()
+        assert len(lines) == 1
+        assert lines[0].endswith("[INFO] root: Moving to The Beatles - Something.mp3")
+        assert lines[0].count("[INFO]") == 1
+    finally:
+        for handler in root.handlers:
+            handler.close()
+        root.handlers[:], root.level = saved
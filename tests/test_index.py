@@ -0,0 +1,58 @@
+""" test_index.py - Test for index.py """
+from sortmp3.index import ScanIndex
+from sortmp3.fix import FixMusicFile
+import os
+import shutil
+import pytest
+
+
+def test_lookup_record(tmp_path):
+    f = tmp_path / "The Beatles - Penny Lane.mp3"
+    f.write_bytes(b"abc")
+    index = ScanIndex.under(tmp_path)
+    assert index.lookup(f, os.stat(f)) is None
+    tags = {"artist": "The Beatles", "album": "Single", "title": "Penny Lane"}
+    index.record(f, tags, f)
+    assert index.lookup(f, os.stat(f)) == tags
+    index.close()
+    #
+    # the index persists, but a modified file is not trusted
+    #
+    index = ScanIndex.under(tmp_path)
+    f.write_bytes(b"abcd")
+    assert index.lookup(f, os.stat(f)) is None
+    assert (index.hits, index.misses) == (0, 1)
+    index.close()
+
+
+def test_incremental_run(tmp_path, monkeypatch):
+    """ a second in-place run with the index does not parse unchanged files """
+    inf = tmp_path / "in"
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir(parents=True)
+    shutil.copy("tests/sample.mp3", albumf / "The Beatles - Penny Lane.mp3")
+    assert FixMusicFile(infolder=inf, outfolder=inf, dry_run=False, index=True).run() == 1
+    fo = inf / "Music/The Beatles/Magical Mystery Tour/The Beatles - Penny Lane.mp3"
+    assert fo.is_file()
+    assert (inf / ".sortmp3" / "index.db").is_file()
+
+    def no_parse(self, file, filtyp):
+        pytest.fail(f"{file} should not be parsed")
+    monkeypatch.setattr(FixMusicFile, "load", no_parse)
+    # an in-place run does not walk the Music Hierarchy: it is fixed again as the infolder
+    assert FixMusicFile(infolder=inf, outfolder=inf, dry_run=False, index=True).run() == 0
+    assert FixMusicFile(infolder=inf / "Music", outfolder=inf, dry_run=False, index=True).run() == 1
+    assert fo.is_file()
+
+
+def test_incremental_run_processes(tmp_path):
+    """ cached tags are handed to worker processes too """
+    inf = tmp_path / "in"
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir(parents=True)
+    shutil.copy("tests/sample.mp3", albumf / "The Beatles - Penny Lane.mp3")
+    for infolder in (inf, inf / "Music"):
+        fmf = FixMusicFile(infolder=infolder, outfolder=inf, dry_run=False, index=True,
+                           jobs=2, executor="process")
+        assert fmf.run() == 1
+    assert (inf / "Music/The Beatles/Magical Mystery Tour/The Beatles - Penny Lane.mp3").is_file()
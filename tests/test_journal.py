@@ -0,0 +1,131 @@
+""" test_journal.py - Test for journal.py """
+import json
+import pytest
+from pathlib import Path
+from sortmp3.fix import FixMusicFile, Decision
+from sortmp3.journal import Journal, journal_path, read_journal
+from test_fix import mk_mp3
+from mutagen import File
+
+TITLES = ["Come Together", "Something", "Oh! Darling"]
+
+
+def mk_album(tmp_path):
+    inf = tmp_path / "in"
+    albumf = inf / "Abbey Road"
+    albumf.mkdir(parents=True)
+    outf = tmp_path / "out"
+    outf.mkdir()
+    for t in TITLES:
+        mk_mp3(albumf / f"The Beatles - {t}.mp3", genre="Rock")
+    return inf, albumf, outf
+
+
+def test_journal_undo(tmp_path):
+    inf, albumf, outf = mk_album(tmp_path)
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, journal=True)
+    assert fmf.run() == 3
+    with open(journal_path(outf), "rb") as f:
+        done, pending = read_journal(f)
+    assert sorted(source for offset, source, final in done) == sorted(str(albumf / f"The Beatles - {t}.mp3") for t in TITLES)
+    assert pending == {}
+    assert not albumf.exists()
+    #
+    # files go back with their original tags, the Music Hierarchy is cleaned
+    #
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False)
+    assert fmf.undo() == 3
+    for t in TITLES:
+        tags = File(albumf / f"The Beatles - {t}.mp3", easy=True)
+        assert "artist" not in tags and "album" not in tags
+        assert tags["genre"] == ["Rock"]
+    assert not any((outf / "Music").iterdir())
+    assert not journal_path(outf).exists()
+
+
+def test_resume(tmp_path, monkeypatch):
+    inf, albumf, outf = mk_album(tmp_path)
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, journal=True)
+    #
+    # the run dies while moving the second file
+    #
+    moves = []
+
+    def move(src, dst):
+        if moves:
+            raise OSError("NAS disconnected")
+        moves.append(src)
+        return original(src, dst)
+    original = fmf.mover.move
+    monkeypatch.setattr(fmf.mover, "move", move)
+    with pytest.raises(OSError):
+        fmf.run()
+    entries = [json.loads(line) for line in journal_path(outf).read_text(encoding="utf-8").splitlines()]
+    assert [entry["op"] for entry in entries] == ["planned", "done", "planned"]
+    journaled = {Path(entry["source"]).name for entry in entries}
+    #
+    # the pending file is placed as planned, only the last one is parsed
+    #
+    decided = []
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False)
+    decide = fmf.decide
+    monkeypatch.setattr(fmf, "decide", lambda file, *args, **kw: decided.append(file.name) or decide(file, *args, **kw))
+    assert fmf.resume() == 2
+    assert len(decided) == 1 and decided[0] not in journaled
+    for t in TITLES:
+        music = outf / f"Music/The Beatles/Abbey Road/The Beatles - {t}.mp3"
+        assert File(music, easy=True)["album"] == ["Abbey Road"]
+    assert not albumf.exists()
+
+
+def test_done_flushed(tmp_path):
+    """ done entries reach the OS as soon as they are written """
+    journal = Journal(tmp_path / "journal.jsonl")
+    decision = Decision(tmp_path / "a.mp3", tmp_path / "A", tmp_path / "A/a.mp3", {}, {}, False)
+    journal.done(decision, decision.target)
+    assert json.loads((tmp_path / "journal.jsonl").read_text(encoding="utf-8"))["op"] == "done"
+    journal.close()
+
+
+def test_done_lost(tmp_path):
+    """ a move whose done entry was lost by a crash is recorded by resume, then undone """
+    inf, albumf, outf = mk_album(tmp_path)
+    assert FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, journal=True).run() == 3
+    path = journal_path(outf)
+    lines = path.read_text(encoding="utf-8").splitlines(keepends=True)
+    # the last move is done, but its done entry never reached the OS
+    assert json.loads(lines[-1])["op"] == "done"
+    path.write_text("".join(lines[:-1]), encoding="utf-8")
+    assert FixMusicFile(infolder=inf, outfolder=outf, dry_run=False).resume() == 0
+    with open(path, "rb") as f:
+        done, pending = read_journal(f)
+    assert len(done) == 3 and pending == {}
+    assert FixMusicFile(infolder=inf, outfolder=outf, dry_run=False).undo() == 3
+    assert sorted(f.name for f in albumf.iterdir()) == sorted(f"The Beatles - {t}.mp3" for t in TITLES)
+    assert not any((outf / "Music").iterdir())
+
+
+def test_undo_pending(tmp_path, monkeypatch):
+    """ the tags of a file planned but not moved when the run died are restored """
+    inf, albumf, outf = mk_album(tmp_path)
+    fmf = FixMusicFile(infolder=inf, outfolder=outf, dry_run=False, journal=True)
+    original = fmf.mover.move
+    moves = []
+
+    def move(src, dst):
+        if moves:
+            raise OSError("NAS disconnected")
+        moves.append(src)
+        return original(src, dst)
+    monkeypatch.setattr(fmf.mover, "move", move)
+    with pytest.raises(OSError):
+        fmf.run()
+    with open(journal_path(outf), "rb") as f:
+        done, pending = read_journal(f)
+    retagged, = pending
+    assert File(retagged, easy=True)["album"] == ["Abbey Road"]
+    assert FixMusicFile(infolder=inf, outfolder=outf, dry_run=False).undo() == 2
+    for t in TITLES:
+        tags = File(albumf / f"The Beatles - {t}.mp3", easy=True)
+        assert "artist" not in tags and "album" not in tags
+    assert not any((outf / "Music").iterdir())
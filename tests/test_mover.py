@@ -0,0 +1,115 @@
+""" test_mover.py - Test for mover.py """
+from sortmp3 import mover
+from sortmp3.mover import Mover
+import threading
+import pytest
+
+
+def test_rename(tmp_path):
+    src = tmp_path / "a.mp3"
+    src.write_bytes(b"x" * 1000)
+    m = Mover()
+    assert m.move(src, tmp_path / "b.mp3") == tmp_path / "b.mp3"
+    assert not src.exists()
+    assert (tmp_path / "b.mp3").read_bytes() == b"x" * 1000
+    assert (m.renamed, m.copied) == (1, 0)
+
+
+def test_copy_verified(tmp_path, monkeypatch):
+    """ across devices the file is copied, verified, then the source removed """
+    src = tmp_path / "a.mp3"
+    data = bytes(range(256)) * 1000
+    src.write_bytes(data)
+    m = Mover(verify=True)
+    monkeypatch.setattr(m, "same_device", lambda src, dst: False)
+    dst = tmp_path / "sub" / "b.mp3"
+    dst.parent.mkdir()
+    m.move(src, dst)
+    assert not src.exists()
+    assert dst.read_bytes() == data
+    assert list(dst.parent.iterdir()) == [dst]
+    assert (m.copied, m.bytes_copied) == (1, len(data))
+
+
+def test_copy_mismatch(tmp_path, monkeypatch):
+    """ a copy that does not match its source is removed and the source kept """
+    src = tmp_path / "a.mp3"
+    src.write_bytes(b"abc")
+    m = Mover(verify=True)
+    monkeypatch.setattr(m, "same_device", lambda src, dst: False)
+    digests = iter([b"1", b"2"])
+    monkeypatch.setattr("sortmp3.mover.file_digest", lambda path: next(digests))
+    with pytest.raises(OSError):
+        m.move(src, tmp_path / "b.mp3")
+    assert src.exists()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.mp3"]
+
+
+def test_streams(tmp_path):
+    """ concurrent moves """
+    m = Mover(streams=4)
+    futures = []
+    for i in range(10):
+        src = tmp_path / f"{i}.mp3"
+        src.write_bytes(b"x")
+        futures.append(m.submit(src, tmp_path / f"{i}.m4a"))
+    assert [f.result().name for f in futures] == [f"{i}.m4a" for i in range(10)]
+    m.close()
+    assert m.renamed == 10
+    assert not m.inflight
+
+
+def test_exclusive(tmp_path, monkeypatch):
+    """ an existing target is never replaced, whatever the way the file is moved """
+    dst = tmp_path / "b.mp3"
+    dst.write_bytes(b"taken")
+    m = Mover(exclusive=True)
+    src = tmp_path / "a.mp3"
+    src.write_bytes(b"x")
+    with pytest.raises(FileExistsError):
+        m.move(src, dst)
+    monkeypatch.setattr(m, "same_device", lambda src, dst: False)
+    with pytest.raises(FileExistsError):
+        m.move(src, dst)
+    assert src.read_bytes() == b"x" and dst.read_bytes() == b"taken"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.mp3", "b.mp3"]
+    m.move(src, tmp_path / "c.mp3")
+    assert not src.exists() and (tmp_path / "c.mp3").read_bytes() == b"x"
+
+
+def test_copy_race(tmp_path, monkeypatch):
+    """ two movers copying to the same target: one wins, the other keeps its source """
+    sources = [tmp_path / "a.mp3", tmp_path / "b.mp3"]
+    for i, src in enumerate(sources):
+        src.write_bytes(bytes([i]) * 100_000)
+    dst = tmp_path / "sub" / "c.mp3"
+    dst.parent.mkdir()
+    # both copies are written before either is renamed into place
+    barrier = threading.Barrier(2, timeout=5)
+
+    def copy_range(fin, fout, size):
+        n = original(fin, fout, size)
+        barrier.wait()
+        return n
+    original = mover.copy_range
+    monkeypatch.setattr(mover, "copy_range", copy_range)
+    outcomes = {}
+
+    def move(src):
+        m = Mover(exclusive=True)
+        m.same_device = lambda src, dst: False
+        try:
+            outcomes[src] = m.move(src, dst)
+        except OSError as e:
+            outcomes[src] = e
+    threads = [threading.Thread(target=move, args=(src,)) for src in sources]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    winner, = [src for src in sources if outcomes[src] == dst]
+    loser, = [src for src in sources if src != winner]
+    assert isinstance(outcomes[loser], FileExistsError)
+    assert not winner.exists() and loser.exists()
+    assert dst.read_bytes() == bytes([sources.index(winner)]) * 100_000
+    assert list(dst.parent.iterdir()) == [dst]
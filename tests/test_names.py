@@ -0,0 +1,34 @@
+""" test_names.py - Test for names.py """
+import re
+from sortmp3.names import sanitize, normalize_spaces, title_case, normalize_many
+
+
+def re_normalize_spaces(text):
+    """ regex version the tables replaced """
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def re_sanitize(s):
+    return re_normalize_spaces(re.sub(r'[<>:"/\\|?*\x00-\x1F]', ' ', s)[:255])
+
+
+def test_same_as_regex():
+    """ every char is handled as the regex did """
+    chars = "".join(chr(c) for c in range(0x3000 + 1) if not 0xD800 <= c <= 0xDFFF)
+    for i in range(0, len(chars), 64):
+        s = "a" + chars[i:i + 64] + " b "
+        assert normalize_spaces(s) == re_normalize_spaces(s)
+        assert sanitize(s) == re_sanitize(s)
+    for s in ["", "   ", "AC/DC", 'a<b>c:d"e', "x" * 300, " " * 254 + "a" + "b" * 10,
+              "Tab\there\nand nbsp em", "Back  In Black "]:
+        assert sanitize(s) == re_sanitize(s)
+
+
+def test_title_case():
+    assert title_case("  the beatles ") == "The Beatles"
+
+
+def test_normalize_many():
+    names = ["AC:DC", "Back  In Black", "AC:DC"]
+    assert normalize_many(names) == ["AC DC", "Back In Black", "AC DC"]
+    assert normalize_many(names, title_case) == ["Ac:Dc", "Back  In Black", "Ac:Dc"]
@@ -0,0 +1,44 @@
+""" test_profiling.py - Test for profiling.py """
+import pstats
+import tracemalloc
+from sortmp3.profiling import Profiler, NULL_PROFILER, percentile
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 0.5) == 50.0
+    assert percentile(values, 0.99) == 99.0
+    assert percentile([3.0], 0.99) == 3.0
+
+
+def test_stages():
+    profiler = Profiler()
+    for i in range(3):
+        with profiler.stage("merge"):
+            pass
+    assert list(profiler.timed("scan", "abc")) == ["a", "b", "c"]
+    profiler.count("bytes read", 10)
+    profiler.count("bytes read", 5)
+    assert len(profiler.durations["merge"]) == 3
+    # one step per item, and the last one finding the end
+    assert len(profiler.durations["scan"]) == 4
+    lines = profiler.summary()
+    assert lines[1].split()[:2] == ["merge", "3"]
+    assert lines[-1].split() == ["bytes", "read", "15"]
+
+
+def test_dumps(tmp_path):
+    profiler = Profiler(cprofile=tmp_path / "run.prof", tracemalloc=tmp_path / "run.snap")
+    profiler.start()
+    sorted(range(1000), key=lambda x: -x)
+    profiler.stop()
+    assert pstats.Stats(str(tmp_path / "run.prof")).total_calls > 0
+    assert tracemalloc.Snapshot.load(str(tmp_path / "run.snap")) is not None
+
+
+def test_null_profiler():
+    with NULL_PROFILER.stage("scan"):
+        pass
+    items = [1, 2]
+    assert NULL_PROFILER.timed("scan", items) is items
+    assert not NULL_PROFILER.enabled
@@ -0,0 +1,42 @@
+""" test_records.py - Test for records.py """
+import tracemalloc
+from sortmp3.fix import FixMusicFile
+from sortmp3.records import Catalog
+from test_fix import mk_mp3
+
+
+def test_catalog(tmp_path):
+    """ decisions come back from their records """
+    inf = tmp_path / "in"
+    albumf = inf / "Abbey Road"
+    albumf.mkdir(parents=True)
+    outf = tmp_path / "out"
+    mk_mp3(albumf / "The Beatles - Come Together.mp3")
+    mk_mp3(albumf / "The Beatles - Something.mp3", title="Something (Remastered)")
+    mk_mp3(inf / "the beatles - let it be.mp3", album="Let It Be")
+    fmf = FixMusicFile(infolder=inf, outfolder=outf)
+    expected = sorted(fmf.decisions(), key=lambda d: d.source)
+    catalog = fmf.catalog()
+    assert len(catalog) == 3
+    records = sorted(catalog, key=lambda r: r.name)
+    assert [r.folder for r in records] == ["Abbey Road", "Abbey Road", ""]
+    assert records[0].artist is records[1].artist
+    assert [r.title for r in records] == [None, "Something (Remastered)", None]
+    decisions = sorted(catalog.decisions(fmf.dirs), key=lambda d: d.source)
+    for got, decision in zip(decisions, expected):
+        assert got._replace(tags_before=None) == decision._replace(tags_before=None)
+
+
+def test_record_size():
+    """ less than 200 bytes per file """
+    n = 20_000
+    catalog = Catalog("/intake")
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(n):
+        artist = f"Artist {i % 500}"
+        catalog.append(f"/intake/{artist}/Album {i % 50}/{artist} - Title {i}.mp3",
+                       {"artist": artist, "album": f"Album {i % 50}", "title": f"Title {i}"}, False)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert size / n < 200
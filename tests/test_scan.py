@@ -0,0 +1,62 @@
+""" test_scan.py - Test for scan.py """
+from sortmp3.scan import scan_music_files, shard_of, WalkFilter
+import os
+import types
+
+
+def test_scan_music_files(tmp_path):
+    """ only files obeying the Artist - Title.mp3|m4a syntax are yielded, at any depth """
+    sub = tmp_path / "a" / "b"
+    sub.mkdir(parents=True)
+    (tmp_path / "The Beatles - Penny Lane.mp3").write_bytes(b"")
+    (sub / "The Beatles - Hello, Goodbye.m4a").write_bytes(b"")
+    (sub / "notes.txt").write_bytes(b"")
+    (sub / "Penny Lane.mp3").write_bytes(b"")
+    (tmp_path / "Fake - Folder.mp3").mkdir()
+    found = scan_music_files(tmp_path)
+    assert isinstance(found, types.GeneratorType)
+    names = sorted(f.name for f, m in found)
+    assert names == ["The Beatles - Hello, Goodbye.m4a", "The Beatles - Penny Lane.mp3"]
+
+
+def test_scan_skip(tmp_path):
+    """ paths listed in skip are ignored """
+    f = tmp_path / "The Beatles - Penny Lane.mp3"
+    f.write_bytes(b"")
+    assert list(scan_music_files(tmp_path, skip={str(f)})) == []
+    (f_, m), = scan_music_files(tmp_path)
+    assert m.group(1) == "The Beatles" and m.group(3) == "mp3"
+
+
+def test_shard_of(tmp_path):
+    """ shards do not depend on where the infolder is mounted """
+    names = [f"Album {i}/Artist - Title {i}.mp3" for i in range(200)]
+    shards = [shard_of(tmp_path / "a" / name, tmp_path / "a", 3) for name in names]
+    assert shards == [shard_of(f"/mnt/intake/{name}", "/mnt/intake", 3) for name in names]
+    assert set(shards) == {0, 1, 2}
+
+
+def test_walk_filter(tmp_path, monkeypatch):
+    """ pruned and excluded folders are never listed; files are filtered by glob, size and mtime """
+    for folder in ("Music/A", "Live/2020", "Studio/Live", "Studio/Demos"):
+        (tmp_path / folder).mkdir(parents=True)
+    for name in ("Music/A/A - Sorted.mp3", "Live/2020/A - Crowd.mp3", "Studio/Live/A - Take.mp3",
+                 "Studio/Demos/A - Demo.mp3", "Studio/A - Small.mp3", "Studio/A - Old.m4a"):
+        (tmp_path / name).write_bytes(bytes(100))
+    (tmp_path / "Studio/A - Small.mp3").write_bytes(bytes(10))
+    os.utime(tmp_path / "Studio/A - Old.m4a", (1_000_000, 1_000_000))
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: listed.append(path) or scandir(path))
+    walk = WalkFilter(tmp_path, prune=[tmp_path / "Music"], exclude=["Live", "/Studio/Demos"],
+                      newer_than=2_000_000, min_size=50)
+    assert [f.name for f, m in scan_music_files(tmp_path, walk=walk)] == []
+    assert sorted(os.path.relpath(p, tmp_path) for p in listed) == [".", "Studio"]
+    walk = WalkFilter(tmp_path, include=["*.m4a", "Studio/Live/*"])
+    assert sorted(f.name for f, m in scan_music_files(tmp_path, walk=walk)) == ["A - Old.m4a", "A - Take.mp3"]
+    assert walk.admits(tmp_path / "Studio/A - Old.m4a")
+    assert not walk.admits(tmp_path / "Studio/A - Small.mp3")
+    walk = WalkFilter(tmp_path, prune=[tmp_path / "Music"], exclude=["Live"])
+    assert not walk.admits(tmp_path / "Music/A/A - Sorted.mp3")
+    assert not walk.admits(tmp_path / "Studio/Live/A - Take.mp3")
+    assert walk.admits(tmp_path / "Studio/Demos/A - Demo.mp3")
@@ -0,0 +1,89 @@
+""" test_tagread.py - Test for tagread.py """
+from sortmp3.formats import read_tags
+from sortmp3.fix import FixMusicFile
+from mutagen.id3 import TIT2, TPE1, TALB
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4
+from mutagen import File
+from pathlib import Path
+import shutil
+import pytest
+
+
+def easy_tags(path):
+    audiofile = File(path, easy=True)
+    return {it: audiofile.get(it, [""])[0] for it in ("artist", "album", "title")}
+
+
+def mk_id3(path, frames, version=3):
+    """ sample.mp3 behind a hand-made ID3v2 tag of (frame id, flags, payload) frames """
+    body = b"".join(fid + len(payload).to_bytes(4, "big") + flags.to_bytes(2, "big") + payload
+                    for fid, flags, payload in frames)
+    # sizes below 128 are the same in syncsafe integers
+    header = b"ID3" + bytes([version, 0, 0, 0, 0, 0, len(body)])
+    path.write_bytes(header + body + Path("tests/sample.mp3").read_bytes())
+
+
+@pytest.mark.parametrize("v2_version", [3, 4])
+def test_read_id3(tmp_path, v2_version):
+    """ same tags as mutagen, whatever the encoding """
+    f = tmp_path / "a.mp3"
+    shutil.copy("tests/sample.mp3", f)
+    audio = MP3(f)
+    audio["TIT2"] = TIT2(encoding=1, text="Penny Lane")
+    audio["TPE1"] = TPE1(encoding=3, text="The Beätles")
+    audio["TALB"] = TALB(encoding=0, text="Magical Mystery Tour")
+    audio.save(v2_version=v2_version)
+    assert read_tags(f, "mp3") == easy_tags(f) == {
+        "artist": "The Beätles", "album": "Magical Mystery Tour", "title": "Penny Lane"}
+
+
+def test_read_id3_untagged(tmp_path):
+    f = tmp_path / "a.mp3"
+    shutil.copy("tests/sample.mp3", f)
+    assert read_tags(f, "mp3") == {"artist": "", "album": "", "title": ""}
+
+
+def test_read_mp4(tmp_path):
+    f = tmp_path / "a.m4a"
+    shutil.copy("tests/sample.m4a", f)
+    audio = MP4(f)
+    audio["\xa9nam"] = ["Penny Lane"]
+    audio["\xa9ART"] = ["The Beätles"]
+    audio.save()
+    assert read_tags(f, "m4a") == easy_tags(f) == {
+        "artist": "The Beätles", "album": "", "title": "Penny Lane"}
+
+
+def test_unreadable(tmp_path):
+    """ files the fast path cannot handle are left to mutagen """
+    f = tmp_path / "a.mp3"
+    f.write_bytes(b"")
+    assert read_tags(f, "mp3") is None
+    f.write_bytes(b"ID3\x02\x00\x00\x00\x00\x00\x10" + bytes(16))
+    assert read_tags(f, "mp3") is None
+    assert read_tags(f, "m4a") is None
+
+
+@pytest.mark.parametrize("version, grouping", [(3, 0x0020), (4, 0x0040)])
+def test_read_id3_left_to_mutagen(tmp_path, version, grouping):
+    """ frames of an unknown encoding or with a group byte are left to mutagen """
+    f = tmp_path / "a.mp3"
+    mk_id3(f, [(b"TIT2", 0, b"\x07Joga"), (b"TPE1", 0, b"\x00Bjork")], version)
+    assert read_tags(f, "mp3") is None
+    mk_id3(f, [(b"TIT2", grouping, b"\x01\x00Joga")], version)
+    assert read_tags(f, "mp3") is None
+    mk_id3(f, [(b"TIT2", 0, b"\x00Joga"), (b"TPE1", 0, b"\x00Bjork")], version)
+    assert read_tags(f, "mp3") == easy_tags(f) == {"artist": "Bjork", "album": "", "title": "Joga"}
+
+
+def test_unknown_encoding_run(tmp_path):
+    """ a frame of an unknown encoding does not stop the run """
+    inf = tmp_path / "in" / "Homogenic"
+    inf.mkdir(parents=True)
+    outf = tmp_path / "out"
+    outf.mkdir()
+    mk_id3(inf / "Björk - Jóga.mp3", [(b"TIT2", 0, b"\x07Joga"), (b"TPE1", 0, b"\x00Bjork")])
+    assert FixMusicFile(infolder=inf.parent, outfolder=outf, dry_run=False).run() == 1
+    assert easy_tags(outf / "Music/Bjork/Homogenic/Bjork - Jóga.mp3") == {
+        "artist": "Bjork", "album": "Homogenic", "title": "Jóga"}
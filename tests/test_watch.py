@@ -0,0 +1,43 @@
+""" test_watch.py - Test for watch.py """
+from sortmp3.fix import FixMusicFile
+from sortmp3.watch import Watcher
+import shutil
+import sys
+import pytest
+
+
+def watch_and_drop(tmp_path, poll):
+    inf = tmp_path / "in"
+    inf.mkdir()
+    outf = tmp_path / "out"
+    outf.mkdir()
+    w = Watcher(FixMusicFile(infolder=inf, outfolder=outf, dry_run=False),
+                interval=0, settle=0, poll=poll)
+    assert w.step() == 0
+    #
+    # a file lands in a new album folder
+    #
+    albumf = inf / "Magical Mystery Tour"
+    albumf.mkdir()
+    shutil.copy("tests/sample.mp3", albumf / "The Beatles - Penny Lane.mp3")
+    #
+    # seen first, fixed once its size is stable
+    #
+    n = 0
+    for i in range(5):
+        n += w.step()
+    w.source.close()
+    assert n == 1
+    assert (outf / "Music/The Beatles/Magical Mystery Tour/The Beatles - Penny Lane.mp3").is_file()
+    # the folder it came from has been cleaned, not the infolder
+    assert not albumf.exists()
+    assert inf.exists()
+
+
+def test_watch_poll(tmp_path):
+    watch_and_drop(tmp_path, poll=True)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_watch_inotify(tmp_path):
+    watch_and_drop(tmp_path, poll=False)